@@ -3,6 +3,7 @@ from config import Config
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_uploads import configure_uploads
+from app.replicas import RoutingSession, init_app as init_replicas
 
 
 """
@@ -13,25 +14,56 @@ when changes made, a new script added to repository that documents change
 -scripts are executed in same order they were created 
 """
 from flask_migrate import Migrate
-# create application object as instance of class Flask
-# __name__ predefined var set to name of module in which it's used
-app = Flask(__name__)
+
+# extensions are made here without an app and bound to one in create_app()
+# so importing the package is cheap and every app instance (ie one per test) gets its own setup
+# RoutingSession sends read-only requests to the read replicas when there are any (see app/replicas.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+migrate = Migrate()
 
 # login
-login = LoginManager(app)
-login.login_view = 'login'
+login = LoginManager()
+login.login_view = 'main.login'
+
+
+# build an application object (instance of class Flask) from a config class
+# config_class can be any subclass of Config (ie one for tests with a throwaway database)
+def create_app(config_class=Config):
+    # __name__ predefined var set to name of module in which it's used
+    app = Flask(__name__)
+
+    # read the config file and apply it
+    app.config.from_object(config_class)
+
+    db.init_app(app)
+    # engines for the read replicas the session picks between
+    init_replicas(app)
+    # db migration object
+    migrate.init_app(app, db)
+    login.init_app(app)
+
+    # handle images
+    configure_uploads(app, config_class.photos)
 
-# read the config file and apply it 
-app.config.from_object(Config)
+    # {% cache %} tag for caching rendered bits of templates (see app/fragments.py)
+    app.jinja_env.add_extension('app.fragments.FragmentCacheExtension')
 
-# db object
-db = SQLAlchemy(app)
+    # imported here rather than at the top so the blueprints (and everything they import) only load
+    # when an app is actually built
+    from app import metrics, sql_budget, replicas, routes, errors, cli
+    # metrics comes first so request timings cover every other hook (after_request hooks run in reverse)
+    app.register_blueprint(metrics.bp)
+    # sql_budget next so it starts counting statements before any other before_request runs
+    app.register_blueprint(sql_budget.bp)
+    # replicas before routes so the database for the request is chosen before any view code queries
+    app.register_blueprint(replicas.bp)
+    # routes will handle diff views when user requests url
+    app.register_blueprint(routes.bp)
+    app.register_blueprint(errors.bp)
+    # cli adds the `flask` maintenance commands
+    app.register_blueprint(cli.bp)
 
-# db migration object
-migrate = Migrate(app, db)
+    return app
 
-# handle images
-configure_uploads(app, Config.photos)
 
-# routes will handle diff views when user requests url 
-from app import routes, models, errors
\ No newline at end of file
+from app import models
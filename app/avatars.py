@@ -0,0 +1,56 @@
+import re
+from functools import lru_cache
+from flask import abort, request, Response
+
+# identicons are drawn here instead of linking to gravatar - drawn in memory on each request (a few hundred bytes
+# of svg), nothing is written to disk, and served with an etag and immutable caching headers so a browser only
+# asks for each one once
+# the route needs no login and any digest draws a picture, so writing each one out would let anyone fill the disk
+
+DIGEST = re.compile(r'^[0-9a-f]{32}$')
+
+# sizes templates ask for are 64 and 128 - anything else gets snapped to the nearest of these
+SIZES = (32, 64, 128, 256)
+
+# one year, same as uploads - a digest/size url always draws the same picture
+MAX_AGE = 31536000
+
+
+def normalize_size(size):
+    return min(SIZES, key=lambda allowed: abs(allowed - size))
+
+
+# gravatar-style identicon: a 5x5 grid mirrored left to right, colour and pattern both taken from the digest
+# the most recently drawn ones are kept, which is a fixed amount of memory however many digests get asked for
+@lru_cache(maxsize=1024)
+def identicon_svg(digest, size):
+    data = bytes.fromhex(digest)
+    hue = int.from_bytes(data[:2], 'big') % 360
+    colour = f'hsl({hue}, 55%, 55%)'
+    cells = []
+    for row in range(5):
+        for column in range(3):
+            # one nibble per cell in the left half + middle column
+            nibble = data[2 + (row * 3 + column) // 2] >> (4 * ((row * 3 + column) % 2)) & 0xF
+            if nibble % 2 == 0:
+                cells.append((column, row))
+                if column < 2:
+                    cells.append((4 - column, row))
+    rects = ''.join(f'<rect x="{x + 0.5}" y="{y + 0.5}" width="1" height="1"/>' for x, y in cells)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" viewBox="0 0 6 6" shape-rendering="crispEdges">'
+        f'<rect width="6" height="6" fill="#f0f0f0"/><g fill="{colour}">{rects}</g></svg>'
+    )
+
+
+def send_avatar(digest, size):
+    if not DIGEST.match(digest):
+        abort(404)
+    size = normalize_size(size)
+    response = Response(identicon_svg(digest, size), mimetype='image/svg+xml')
+    # a digest/size always draws the same picture, so the etag is strong and never changes
+    response.set_etag(f'{digest}-{size}')
+    response.cache_control.public = True
+    response.cache_control.max_age = MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
@@ -0,0 +1,312 @@
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from hashlib import md5
+from types import SimpleNamespace
+import sqlalchemy as sa
+from flask import current_app, g, request_finished
+from app import db
+from app.models import User, Puzzle, Category, Message, Conversation, PuzzleSearchTerm, puzzle_category
+from app.search import search_rows
+from app.catalog import insert_returning_ids
+from app.passwords import hash_password
+from app.pagination import encode_cursor
+from app.cache import feed_cache
+from app.fragments import fragment_cache
+
+# synthetic data + timings for the pages that matter most (run with `flask bench seed` / `flask bench run`)
+#
+# seed bulk inserts users, puzzles (with categories and search index rows) and message threads with a mix
+# of read/deleted flags - a scale is the number of puzzles, users and messages are sized from it
+# run logs in as the busiest seeded user and times each page through the test client, printing JSON
+# so runs can be saved and compared
+
+SCALES = {
+    '1k': 1_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+# everyone seeded gets this password (hashed once - hashing per user would take longer than the inserts)
+PASSWORD = 'bench'
+
+# seeded usernames all start with this so a real account can't be picked as the benchmark user
+USERNAME_PREFIX = 'bench_'
+
+CATEGORIES = ['Animals', 'Landscape', 'Art', 'Food', 'Travel', 'Fantasy', 'Vintage', 'Holiday',
+              'Flowers', 'Cities', 'Ocean', 'Space', 'Birds', 'Cats', 'Dogs', 'Maps']
+ADJECTIVES = ['Mountain', 'Autumn', 'Sunny', 'Misty', 'Golden', 'Hidden', 'Winter', 'Coastal',
+              'Quiet', 'Starry', 'Painted', 'Tiny', 'Grand', 'Lazy', 'Busy', 'Secret']
+NOUNS = ['lake', 'village', 'garden', 'harbour', 'market', 'library', 'forest', 'castle',
+         'kitchen', 'meadow', 'bridge', 'lighthouse', 'station', 'canyon', 'orchard', 'cottage']
+MANUFACTURERS = ['Ravensburger', 'Buffalo', 'Cobble Hill', 'Eurographics', 'White Mountain', 'Springbok', 'Galison']
+CONDITIONS = ['New', 'Like new', 'Good', 'Fair']
+PIECES = [300, 500, 750, 1000, 1500, 2000]
+
+# word that turns up in a sixteenth of the titles - used for the search timings
+SEARCH_QUERY = 'mountain'
+
+# how far down the feed / search results the deep page timings go
+DEEP_PAGE = 50
+
+
+def scale_sizes(scale):
+    puzzles = SCALES[scale]
+    return {
+        'users': max(puzzles // 10, 20),
+        'puzzles': puzzles,
+        # about four messages per thread
+        'threads': max(puzzles // 2, 10),
+    }
+
+
+def insert_batches(table, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(sa.insert(table), rows[start:start + batch_size])
+
+
+def next_user_number():
+    return (db.session.scalar(sa.select(sa.func.max(User.id))) or 0) + 1
+
+
+# fills the database with a synthetic dataset - returns how many rows of each kind were made
+# runs are repeatable: the same scale and seed make the same data
+def seed(scale, seed=0, batch_size=5000):
+    sizes = scale_sizes(scale)
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    password_hash = hash_password(PASSWORD)
+
+    # USERS
+    # usernames carry the next free id so seeding twice doesn't clash
+    run = f'{next_user_number()}_'
+    users = []
+    for offset in range(sizes['users']):
+        username = f'{USERNAME_PREFIX}{run}{offset}'
+        users.append({
+            'username': username,
+            'email': f'{username}@example.com',
+            'password_hash': password_hash,
+            'avatar_digest': md5(username.encode('utf-8')).hexdigest(),
+            'about_me': 'Benchmark user',
+            'last_seen': now - timedelta(minutes=rng.randrange(60 * 24 * 30)),
+            'unread_count': 0,
+        })
+    user_ids = insert_returning_ids(User, users, batch_size)
+
+    # CATEGORIES (reuse any that already exist by name)
+    existing = {name: id for id, name in db.session.execute(sa.select(Category.id, Category.name))}
+    missing = [{'name': name} for name in CATEGORIES if name not in existing]
+    if missing:
+        db.session.execute(sa.insert(Category), missing)
+        existing = {name: id for id, name in db.session.execute(sa.select(Category.id, Category.name))}
+    categories = [(existing[name], name) for name in CATEGORIES]
+
+    # PUZZLES - built a batch at a time so 1m puzzles never sit in memory at once
+    # (puzzle id, owner) - needed to make message threads
+    owners = []
+    for start in range(0, sizes['puzzles'], batch_size):
+        puzzles, chosen_categories = [], []
+        for offset in range(start, min(start + batch_size, sizes['puzzles'])):
+            owner = rng.choice(user_ids)
+            is_deleted = rng.random() < 0.05
+            is_available = not is_deleted and rng.random() < 0.8
+            puzzle = {
+                'image_url': f'/uploads/bench-{offset % 50}.jpg',
+                'pieces': rng.choice(PIECES),
+                'condition': rng.choice(CONDITIONS),
+                'title': f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}',
+                'manufacturer': rng.choice(MANUFACTURERS),
+                'description': f'A {rng.choice(ADJECTIVES).lower()} {rng.choice(NOUNS)} puzzle',
+                'timestamp': now - timedelta(seconds=rng.randrange(60 * 60 * 24 * 365)),
+                'is_available': is_available,
+                'is_requested': not is_deleted and not is_available and rng.random() < 0.5,
+                'in_progress': False,
+                'is_deleted': is_deleted,
+                'user_id': owner,
+                'version': 1,
+            }
+            puzzles.append(puzzle)
+            chosen_categories.append(rng.sample(categories, rng.randint(1, 3)))
+        puzzle_ids = insert_returning_ids(Puzzle, puzzles, batch_size)
+        links, terms = [], []
+        for puzzle_id, puzzle, chosen in zip(puzzle_ids, puzzles, chosen_categories):
+            owners.append((puzzle_id, puzzle['user_id']))
+            links.extend({'puzzle_id': puzzle_id, 'category_id': category_id} for category_id, _ in chosen)
+            if not puzzle['is_deleted']:
+                # same rows app/search.py would make, without loading every puzzle back through the ORM
+                fields = SimpleNamespace(categories=[SimpleNamespace(name=name) for _, name in chosen], **puzzle)
+                terms.extend(search_rows(puzzle_id, fields))
+        db.session.execute(sa.insert(puzzle_category), links)
+        insert_batches(PuzzleSearchTerm, terms, batch_size)
+
+    # MESSAGE THREADS - someone asks about a puzzle and the owner writes back and forth with them
+    messages = []
+    message_count = 0
+    for _ in range(sizes['threads']):
+        puzzle_id, owner = rng.choice(owners)
+        requester = rng.choice(user_ids)
+        if requester == owner:
+            continue
+        started = now - timedelta(seconds=rng.randrange(60 * 60 * 24 * 180))
+        for position in range(rng.randint(1, 7)):
+            # odd messages are the owner's replies
+            sender, recipient = (requester, owner) if position % 2 == 0 else (owner, requester)
+            messages.append({
+                'puzzle_id': puzzle_id,
+                'sender_requester_id': sender,
+                'recipient_owner_id': recipient,
+                'is_deleted_by_sender': rng.random() < 0.05,
+                'is_deleted_by_recipient': rng.random() < 0.05,
+                'is_read': rng.random() < 0.7,
+                'is_automated': position == 0 and rng.random() < 0.2,
+                'content': f'Message {position} about puzzle {puzzle_id}',
+                'timestamp': started + timedelta(minutes=position * rng.randint(1, 600)),
+            })
+        if len(messages) >= batch_size:
+            db.session.execute(sa.insert(Message), messages)
+            message_count += len(messages)
+            messages = []
+    if messages:
+        db.session.execute(sa.insert(Message), messages)
+        message_count += len(messages)
+
+    db.session.commit()
+    # unread badges and the inbox's conversations are kept on write, bring them in line with the messages just inserted
+    User.reconcile_unread_counts()
+    Conversation.rebuild()
+    return {'users': len(users), 'puzzles': sizes['puzzles'], 'messages': message_count}
+
+
+# the seeded user with the most messages - their inbox and threads are the slowest to build
+def busiest_user():
+    return db.session.scalar(
+        sa.select(User)
+        .join(Message, Message.recipient_owner_id == User.id)
+        .where(User.username.startswith(USERNAME_PREFIX))
+        .group_by(User.id)
+        .order_by(sa.func.count(Message.id).desc())
+        .limit(1))
+
+
+# cursor for the feed page `page` pages in (the same cursor the feed's Next link would have)
+def feed_cursor(user, page, per_page=6):
+    row = db.session.execute(
+        sa.select(Puzzle.timestamp, Puzzle.id)
+        .where(Puzzle.is_available == True, Puzzle.user_id != user.id)
+        .order_by(Puzzle.timestamp.desc(), Puzzle.id.desc())
+        .offset((page - 1) * per_page - 1)
+        .limit(1)).first()
+    return encode_cursor('next', row.timestamp, row.id) if row else None
+
+
+def percentile(timings, percent):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def summarize(timings, statements):
+    return {
+        'runs': len(timings),
+        'min_ms': round(min(timings) * 1000, 3),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'max_ms': round(max(timings) * 1000, 3),
+        'mean_ms': round(statistics.fmean(timings) * 1000, 3),
+        # SQL statements per request, from app/sql_budget.py's counts
+        'statements': max(statements) if statements else None,
+    }
+
+
+# times each page `iterations` times and returns the results as a dict (ready for json.dumps)
+# caches are emptied before every request unless warm=True so the timings are for the database work
+def run(iterations=20, warm=False):
+    user = busiest_user()
+    if user is None:
+        raise ValueError('no benchmark data - run `flask bench seed` first')
+    partner = db.session.execute(
+        sa.select(Message.sender_requester_id, Message.puzzle_id)
+        .where(Message.recipient_owner_id == user.id)
+        .order_by(Message.timestamp.desc())
+        .limit(1)).first()
+    unread_ids = db.session.scalars(
+        sa.select(Message.id)
+        .where(Message.recipient_owner_id == user.id, Message.is_read == False)
+        .limit(iterations)).all()
+    deep_cursor = feed_cursor(user, DEEP_PAGE)
+
+    # GET pages by name - each value is the url to fetch
+    pages = {
+        'index': '/index',
+        'index_deep_page': f'/index?cursor={deep_cursor}' if deep_cursor else '/index',
+        'index_search': f'/index?query={SEARCH_QUERY}',
+        'index_search_deep_page': f'/index?query={SEARCH_QUERY}&page={DEEP_PAGE}',
+        'messages': '/messages',
+        'messages_thread': f'/messages?recipient_id={partner.sender_requester_id}&puzzle_id={partner.puzzle_id}',
+        'user': f'/user/{user.username}',
+    }
+
+    statements = []
+
+    def count_statements(sender, response, **extra):
+        stats = g.get('sql_stats')
+        if stats is not None:
+            statements.append(stats.count)
+
+    def timed(client, method, url):
+        if not warm:
+            feed_cache.clear()
+            fragment_cache.clear()
+        started = time.perf_counter()
+        response = getattr(client, method)(url)
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise RuntimeError(f'{method.upper()} {url} returned {response.status_code}')
+        return elapsed
+
+    def time_pages():
+        results = {}
+        with app.test_client() as client:
+            # log straight in through the session so the login form (and its csrf token) isn't in the way
+            with client.session_transaction() as session:
+                session['_user_id'] = str(user_id)
+                session['_fresh'] = True
+            for name, url in pages.items():
+                # first request warms up templates / connections and isn't counted
+                timed(client, 'get', url)
+                statements.clear()
+                timings = [timed(client, 'get', url) for _ in range(iterations)]
+                results[name] = summarize(timings, list(statements))
+            # each run reads a different message so every one does the real work
+            statements.clear()
+            timings = [timed(client, 'post', f'/message/read/{message_id}') for message_id in unread_ids]
+            if timings:
+                results['mark_message_as_read'] = summarize(timings, list(statements))
+        return results
+
+    user_id = user.id
+    app = current_app._get_current_object()
+    request_finished.connect(count_statements, app)
+    try:
+        # requests made from here would share this app context (and so one db session and its identity map)
+        # - a thread of their own gets each request a fresh context, like a real server does
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            results = executor.submit(time_pages).result()
+    finally:
+        request_finished.disconnect(count_statements, app)
+
+    return {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'database': db.engine.dialect.name,
+        'rows': {
+            'users': db.session.scalar(sa.select(sa.func.count(User.id))),
+            'puzzles': db.session.scalar(sa.select(sa.func.count(Puzzle.id))),
+            'messages': db.session.scalar(sa.select(sa.func.count(Message.id))),
+        },
+        'user': user.username,
+        'iterations': iterations,
+        'warm_cache': warm,
+        'results': results,
+    }
@@ -0,0 +1,96 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from app import db
+
+# in-memory LRU caches with a ttl - used for home feed / search result pages and rendered
+# puzzle cards (see app/fragments.py)
+#
+# for the feed cache every key includes the catalog version, and anything that changes which puzzles are visible calls
+# bump_catalog_version() - so old entries are never served again and just fall out of the LRU
+# the version lives in this process only, so with several worker processes a change made in another
+# worker shows up once the entry's ttl runs out
+# settings read from app config: <name>_SIZE (entries) and <name>_TTL (seconds), ie FEED_CACHE_SIZE
+
+
+class ResultCache:
+    def __init__(self, config_name, default_size, default_ttl):
+        self._config_name = config_name
+        self._default_size = default_size
+        self._default_ttl = default_ttl
+        self._lock = threading.Lock()
+        # key -> (expires_at, value), oldest used first
+        self._entries = OrderedDict()
+        self._version = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def bump_version(self):
+        with self._lock:
+            self._version += 1
+            # nothing older can be asked for again so free the memory now
+            self._entries.clear()
+
+    # version is the one read before the value was loaded (see cached_page) - defaults to the current one
+    def get(self, key, version=None):
+        key = (self._version if version is None else version, key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, version=None):
+        config = current_app.config
+        max_size = config.get(f'{self._config_name}_SIZE', self._default_size)
+        ttl = config.get(f'{self._config_name}_TTL', self._default_ttl)
+        with self._lock:
+            if version is None:
+                version = self._version
+            elif version != self._version:
+                # the version was bumped while value was being loaded so it may already be out of date
+                return
+            key = (version, key)
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+feed_cache = ResultCache('FEED_CACHE', default_size=512, default_ttl=30)
+
+
+# call whenever a puzzle is added, edited, deleted or changes status
+def bump_catalog_version():
+    feed_cache.bump_version()
+
+
+# returns the cached page of results for key, or runs load() and caches what it returns
+# the page's puzzles are cached detached from any session - each request gets its own copies
+# attached to its session with merge(load=False), which doesn't run any SQL
+# the version is read once before load() runs so a page loaded across a bump_catalog_version() isn't kept
+def cached_page(key, load):
+    version = feed_cache.version
+    page = feed_cache.get(key, version)
+    if page is None:
+        page = load()
+        # detach the cached copy so it never holds on to this request's session
+        for item in page.items:
+            db.session.expunge(item)
+        feed_cache.set(key, page, version)
+    page = copy.copy(page)
+    page.items = [db.session.merge(item, load=False) for item in page.items]
+    return page
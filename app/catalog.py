@@ -0,0 +1,265 @@
+import csv
+import json
+import os
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import sqlalchemy as sa
+from flask import current_app, url_for
+from werkzeug.datastructures import FileStorage
+from flask_uploads import UploadNotAllowed
+from app import db
+from app.models import User, Puzzle, Category, puzzle_category, PuzzleSearchTerm
+from app.search import search_rows
+from app.uploads import save_upload
+from app.images import queue_variants
+from app.loaders import with_puzzle_cards
+
+# bulk import/export of the puzzle catalog (run with `flask catalog import` / `flask catalog export`)
+#
+# files are CSV (one row per puzzle, header row of field names) or JSONL (one JSON object per line)
+# fields: title, pieces, condition, manufacturer, description, categories, owner, image, timestamp, is_available
+# - categories: a list in JSONL, names separated by | in CSV
+# - owner: username (falls back to the owner given on the command line)
+# - image: filename inside the images folder given on the command line
+# rows are read and written one batch at a time so any size of file runs in the same memory
+
+FIELDS = ('title', 'pieces', 'condition', 'manufacturer', 'description', 'categories', 'owner', 'image',
+          'timestamp', 'is_available')
+
+CATEGORY_SEPARATOR = '|'
+
+
+class CatalogError(ValueError):
+    pass
+
+
+def file_format(path, format=None):
+    format = format or os.path.splitext(path)[1].lstrip('.').lower()
+    if format not in ('csv', 'jsonl'):
+        raise CatalogError(f'unknown file format {format!r} - use csv or jsonl')
+    return format
+
+
+# yields (line number, row dict) from an open file
+def read_rows(file, format):
+    if format == 'csv':
+        # line_num is where the row ended, which is the line a person would look at
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for number, line in enumerate(file, start=1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as e:
+                    yield number, e
+
+
+# bulk insert that hands back the new rows' ids in the same order as rows
+def insert_returning_ids(model, rows, batch_size):
+    ids = []
+    for start in range(0, len(rows), batch_size):
+        ids.extend(db.session.scalars(
+            sa.insert(model).returning(model.id, sort_by_parameter_order=True), rows[start:start + batch_size]))
+    return ids
+
+
+def parse_bool(value, default):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+# text cut to the length of its column (ie String(120) -> 120) - anything longer would fail the whole batch's
+# insert on a database that checks lengths - None when there's nothing there
+def parse_text(value, length):
+    if value is None:
+        return None
+    return str(value).strip()[:length] or None
+
+
+def parse_categories(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(CATEGORY_SEPARATOR)
+    return [str(name).strip() for name in value if str(name).strip()]
+
+
+class PuzzleImporter:
+    def __init__(self, default_owner=None, images_folder=None, create_categories=False, batch_size=1000):
+        self.default_owner = default_owner
+        self.images_folder = images_folder
+        self.create_categories = create_categories
+        self.batch_size = batch_size
+        # lowercased name -> id, filled in as batches need them so each name is only looked up once
+        self.category_ids = {}
+        self.user_ids = {}
+        self.imported = 0
+        # (line number, message) for every row that was skipped
+        self.errors = []
+
+    def resolve_categories(self, names):
+        missing = {name.lower(): name for name in names if name.lower() not in self.category_ids}
+        if not missing:
+            return
+        found = db.session.execute(
+            sa.select(Category.id, Category.name).where(sa.func.lower(Category.name).in_(list(missing))))
+        for id, name in found:
+            self.category_ids[name.lower()] = id
+            missing.pop(name.lower(), None)
+        if missing and self.create_categories:
+            ids = insert_returning_ids(Category, [{'name': name} for name in missing.values()], self.batch_size)
+            self.category_ids.update(zip(missing, ids))
+
+    def resolve_users(self, usernames):
+        missing = [username for username in usernames if username not in self.user_ids]
+        if missing:
+            self.user_ids.update(db.session.execute(sa.select(User.username, User.id).where(User.username.in_(missing))).all())
+
+    def save_image(self, filename):
+        path = os.path.join(self.images_folder, filename)
+        with open(path, 'rb') as stream:
+            # same storage as a form upload so the file is deduplicated and named by its hash
+            return save_upload(FileStorage(stream=stream, filename=filename))
+
+    # turns a row into the values for a Puzzle insert (raises CatalogError when something is wrong with it)
+    def puzzle_values(self, row):
+        if isinstance(row, Exception):
+            raise CatalogError(f'not valid JSON: {row}')
+        if not isinstance(row, dict):
+            raise CatalogError('should be a JSON object')
+        title = parse_text(row.get('title'), 64)
+        if not title:
+            raise CatalogError('title is missing')
+        try:
+            pieces = int(row.get('pieces'))
+        except (TypeError, ValueError):
+            raise CatalogError(f"pieces should be a number, not {row.get('pieces')!r}")
+        owner = row.get('owner') or self.default_owner
+        if owner not in self.user_ids:
+            raise CatalogError(f'no user called {owner!r}' if owner else 'owner is missing')
+        names = parse_categories(row.get('categories'))
+        unknown = [name for name in names if name.lower() not in self.category_ids]
+        if unknown:
+            raise CatalogError(f"unknown categories: {', '.join(unknown)}")
+        timestamp = row.get('timestamp')
+        try:
+            timestamp = datetime.fromisoformat(timestamp) if timestamp else datetime.now(timezone.utc)
+        except (TypeError, ValueError):
+            raise CatalogError(f'timestamp should be ISO 8601, not {timestamp!r}')
+        image_url, saved_image = '', None
+        if row.get('image'):
+            if not self.images_folder:
+                raise CatalogError('has an image but no images folder was given')
+            try:
+                saved_image = self.save_image(row['image'])
+            except (OSError, UploadNotAllowed) as e:
+                raise CatalogError(f"could not use image {row['image']!r}: {e or 'file type not allowed'}")
+            image_url = url_for('main.get_file', filename=saved_image)
+        is_available = parse_bool(row.get('is_available'), True)
+        values = {
+            'title': title,
+            'pieces': pieces,
+            'condition': parse_text(row.get('condition'), 64),
+            'manufacturer': parse_text(row.get('manufacturer'), 64) or '',
+            'description': parse_text(row.get('description'), 120),
+            'image_url': image_url,
+            'timestamp': timestamp,
+            'is_available': is_available,
+            'is_requested': False,
+            'in_progress': False,
+            'is_deleted': False,
+            'user_id': self.user_ids[owner],
+        }
+        return values, [self.category_ids[name.lower()] for name in names], names, saved_image
+
+    def import_batch(self, batch):
+        self.resolve_users({row.get('owner') or self.default_owner for _, row in batch if isinstance(row, dict)} - {None})
+        self.resolve_categories({name for _, row in batch if isinstance(row, dict) for name in parse_categories(row.get('categories'))})
+        puzzles, extras = [], []
+        for number, row in batch:
+            try:
+                values, category_ids, names, saved_image = self.puzzle_values(row)
+            except CatalogError as e:
+                self.errors.append((number, str(e)))
+                continue
+            puzzles.append(values)
+            extras.append((category_ids, names, saved_image))
+        if not puzzles:
+            return
+        puzzle_ids = insert_returning_ids(Puzzle, puzzles, self.batch_size)
+        links, terms, images = [], [], []
+        for puzzle_id, values, (category_ids, names, saved_image) in zip(puzzle_ids, puzzles, extras):
+            # a category listed twice only gets linked once
+            links.extend({'puzzle_id': puzzle_id, 'category_id': category_id} for category_id in dict.fromkeys(category_ids))
+            fields = SimpleNamespace(categories=[SimpleNamespace(name=name) for name in names], **values)
+            terms.extend(search_rows(puzzle_id, fields))
+            if saved_image:
+                images.append((puzzle_id, saved_image, values['image_url']))
+        if links:
+            db.session.execute(sa.insert(puzzle_category), links)
+        if terms:
+            db.session.execute(sa.insert(PuzzleSearchTerm), terms)
+        db.session.commit()
+        self.imported += len(puzzles)
+        # resizing happens in the background like it does for uploads
+        for puzzle_id, saved_image, image_url in images:
+            queue_variants(puzzle_id, saved_image, image_url)
+
+    def run(self, rows):
+        if self.default_owner:
+            self.resolve_users([self.default_owner])
+            if self.default_owner not in self.user_ids:
+                raise CatalogError(f'no user called {self.default_owner!r}')
+        # url_for needs a request to build the upload urls from outside the web app
+        with current_app.test_request_context():
+            batch = []
+            for number, row in rows:
+                batch.append((number, row))
+                if len(batch) >= self.batch_size:
+                    self.import_batch(batch)
+                    batch = []
+            if batch:
+                self.import_batch(batch)
+        return self.imported
+
+
+# yields one dict per puzzle in the same shape the importer reads
+def export_rows(include_deleted=False, batch_size=1000):
+    select = (with_puzzle_cards(sa.select(Puzzle))
+              .order_by(Puzzle.id)
+              .execution_options(yield_per=batch_size))
+    if not include_deleted:
+        select = select.where(Puzzle.is_deleted == False)
+    for puzzle in db.session.scalars(select):
+        yield {
+            'title': puzzle.title,
+            'pieces': puzzle.pieces,
+            'condition': puzzle.condition,
+            'manufacturer': puzzle.manufacturer,
+            'description': puzzle.description,
+            'categories': [category.name for category in puzzle.categories],
+            'owner': puzzle.author.username,
+            'image': puzzle.image_url.rsplit('/', 1)[-1] if puzzle.image_url else None,
+            'timestamp': puzzle.timestamp.isoformat(),
+            'is_available': puzzle.is_available,
+        }
+
+
+def write_rows(file, format, rows):
+    count = 0
+    if format == 'csv':
+        writer = csv.DictWriter(file, fieldnames=FIELDS, lineterminator='\n')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(row, categories=CATEGORY_SEPARATOR.join(row['categories'])))
+            count += 1
+    else:
+        for row in rows:
+            file.write(json.dumps(row) + '\n')
+            count += 1
+    return count
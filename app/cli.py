@@ -0,0 +1,265 @@
+import click
+from flask import Blueprint
+
+
+# flask commands for maintenance jobs (run with `flask <group> <command>`)
+# cli_group=None puts the groups straight under `flask` instead of under `flask cli`
+bp = Blueprint('cli', __name__, cli_group=None)
+
+# SEARCH INDEX
+@bp.cli.group()
+def search():
+    """Search index commands."""
+    pass
+
+
+@search.command()
+def reindex():
+    """Rebuild the puzzle search index from scratch."""
+    # imported here so the cli module doesn't pull in the search module at startup
+    from app.search import reindex_all
+    count = reindex_all()
+    click.echo(f'Indexed {count} puzzles')
+
+
+# MESSAGES
+@bp.cli.group()
+def messages():
+    """Messaging commands."""
+    pass
+
+
+@messages.command('reconcile-unread')
+def reconcile_unread():
+    """Recount every user's unread messages and fix the stored badge counts."""
+    from app.models import User
+    fixed = User.reconcile_unread_counts()
+    click.echo(f'Fixed unread count for {fixed} users')
+
+
+@messages.command('rebuild-conversations')
+def rebuild_conversations():
+    """Rebuild the inbox's conversation table from the messages."""
+    from app.models import Conversation
+    count = Conversation.rebuild()
+    click.echo(f'Rebuilt {count} conversations')
+
+
+# IMAGES
+@bp.cli.group()
+def images():
+    """Puzzle image commands."""
+    pass
+
+
+@images.command('variants')
+def build_variants():
+    """Make resized copies for puzzles that don't have them yet."""
+    import sqlalchemy as sa
+    from app import db
+    from app.models import Puzzle
+    from app.images import Image, make_variants
+    if Image is None:
+        raise click.ClickException('Pillow is not installed')
+    puzzles = db.session.scalars(sa.select(Puzzle).where(Puzzle.image_variants == None, Puzzle.is_deleted == False)).all()
+    made = 0
+    for puzzle in puzzles:
+        try:
+            puzzle.image_variants = make_variants(puzzle.image_url.rsplit('/', 1)[-1], puzzle.image_url)
+            made += 1
+        except Exception as e:
+            click.echo(f'Skipped puzzle {puzzle.id}: {e}')
+    db.session.commit()
+    click.echo(f'Made image variants for {made} puzzles')
+
+
+# BENCHMARKS
+@bp.cli.group()
+def bench():
+    """Benchmark data and timings."""
+    pass
+
+
+@bench.command('seed')
+@click.option('--scale', type=click.Choice(['1k', '100k', '1m']), default='1k', help='Number of puzzles to make.')
+@click.option('--seed', 'random_seed', default=0, help='Random seed, the same seed makes the same data.')
+@click.option('--batch-size', default=5000, help='Rows per insert.')
+def bench_seed(scale, random_seed, batch_size):
+    """Fill the database with synthetic users, puzzles and messages."""
+    from app.bench import seed
+    counts = seed(scale, seed=random_seed, batch_size=batch_size)
+    click.echo(f"Made {counts['users']} users, {counts['puzzles']} puzzles and {counts['messages']} messages")
+
+
+@bench.command('run')
+@click.option('--iterations', default=20, help='Times to request each page.')
+@click.option('--warm', is_flag=True, help='Keep the page caches between requests.')
+@click.option('--output', type=click.File('w'), default='-', help='File to write the JSON results to.')
+def bench_run(iterations, warm, output):
+    """Time the busiest pages against the seeded data and print the results as JSON."""
+    import json
+    from app.bench import run
+    try:
+        results = run(iterations=iterations, warm=warm)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    json.dump(results, output, indent=2)
+    output.write('\n')
+
+
+# LOAD TEST
+@bp.cli.group()
+def loadtest():
+    """Concurrent load test commands."""
+    pass
+
+
+@loadtest.command('run')
+@click.option('--users', default=10, help='Simulated users, each one a thread.')
+@click.option('--duration', default=30, help='Seconds to keep the load going.')
+@click.option('--url', default=None, help='Server to aim at (default: serve the app from this process).')
+@click.option('--think-time', default=0.0, help='Average seconds each user waits between steps.')
+@click.option('--seed', 'random_seed', default=0, help='Random seed for picking puzzles and actions.')
+@click.option('--output', type=click.File('w'), default='-', help='File to write the JSON results to.')
+def loadtest_run(users, duration, url, think_time, random_seed, output):
+    """Run seeded users through login, feed, search, requests and messages at the same time."""
+    import json
+    from app.loadtest import run
+    try:
+        results = run(users=users, duration=duration, base_url=url, think_time=think_time, seed=random_seed)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    json.dump(results, output, indent=2)
+    output.write('\n')
+
+
+# CATALOG
+@bp.cli.group()
+def catalog():
+    """Bulk puzzle import and export."""
+    pass
+
+
+@catalog.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), default=None, help='Defaults to the file extension.')
+@click.option('--owner', default=None, help='Username to own puzzles whose row has no owner.')
+@click.option('--images', type=click.Path(exists=True, file_okay=False), default=None, help='Folder the image filenames are in.')
+@click.option('--create-categories', is_flag=True, help='Make categories that don\'t exist yet instead of skipping the row.')
+@click.option('--batch-size', default=1000, help='Rows per insert.')
+def import_catalog(path, file_format, owner, images, create_categories, batch_size):
+    """Import puzzles from a CSV or JSONL file."""
+    from app.catalog import CatalogError, PuzzleImporter, file_format as guess_format, read_rows
+    importer = PuzzleImporter(default_owner=owner, images_folder=images, create_categories=create_categories,
+                              batch_size=batch_size)
+    try:
+        file_format = guess_format(path, file_format)
+        with open(path, newline='', encoding='utf-8') as file:
+            importer.run(read_rows(file, file_format))
+    except CatalogError as e:
+        raise click.ClickException(str(e))
+    for number, message in importer.errors:
+        click.echo(f'Skipped line {number}: {message}', err=True)
+    click.echo(f'Imported {importer.imported} puzzles, skipped {len(importer.errors)}')
+
+
+@catalog.command('export')
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), default=None, help='Defaults to the file extension.')
+@click.option('--include-deleted', is_flag=True, help='Export soft deleted puzzles too.')
+@click.option('--batch-size', default=1000, help='Puzzles loaded per query.')
+def export_catalog(path, file_format, include_deleted, batch_size):
+    """Export puzzles to a CSV or JSONL file (- for stdout, which needs --format)."""
+    from app.catalog import CatalogError, export_rows, file_format as guess_format, write_rows
+    try:
+        file_format = guess_format(path, file_format)
+    except CatalogError as e:
+        raise click.ClickException(str(e))
+    with click.open_file(path, 'w', encoding='utf-8') as file:
+        count = write_rows(file, file_format, export_rows(include_deleted=include_deleted, batch_size=batch_size))
+    click.echo(f'Exported {count} puzzles', err=True)
+
+
+# STARTUP
+@bp.cli.group()
+def startup():
+    """App startup commands."""
+    pass
+
+
+@startup.command('check')
+@click.option('--budget', type=float, default=None, help='Seconds allowed (default: STARTUP_BUDGET in config, or 1.5).')
+@click.option('--top', default=10, help='How many of the slowest imports to list.')
+def startup_check(budget, top):
+    """Time importing and building the app in a fresh process, failing when it's over budget."""
+    from flask import current_app
+    from app.startup import measure_startup
+    if budget is None:
+        budget = current_app.config.get('STARTUP_BUDGET', 1.5)
+    try:
+        seconds, modules = measure_startup()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    for module_seconds, module in modules[:top]:
+        click.echo(f'{module_seconds * 1000:8.1f}ms  {module}')
+    click.echo(f'Startup took {seconds * 1000:.1f}ms, budget is {budget * 1000:.0f}ms')
+    if seconds > budget:
+        raise click.ClickException('over the startup budget')
+
+
+# INDEXES
+@bp.cli.group()
+def indexes():
+    """Index commands."""
+    pass
+
+
+@indexes.command('check')
+@click.option('--username', default=None, help='User to load the pages as (default: whoever has the most messages).')
+def indexes_check(username):
+    """EXPLAIN the queries behind the busiest pages, failing when any of them reads more of a table than it needs."""
+    import sqlalchemy as sa
+    from app import db
+    from app.models import User
+    from app.query_plans import check_query_plans
+    user = None
+    if username:
+        user = db.session.scalar(sa.select(User).where(User.username == username))
+        if user is None:
+            raise click.ClickException(f'no user called {username!r}')
+    try:
+        pages, problems = check_query_plans(user)
+    except (ValueError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+    for name, url in pages.items():
+        click.echo(f"{'BAD PLAN' if name in problems else 'ok':9}  {name}  {url}")
+        for statement, plan in problems.get(name, []):
+            click.echo(f"    {' '.join(statement.split())}")
+            for line in plan:
+                click.echo(f'      {line}')
+    if problems:
+        raise click.ClickException(f'{len(problems)} page(s) run a query that does not use an index properly')
+
+
+# READ REPLICAS
+@bp.cli.group()
+def replicas():
+    """Read replica commands."""
+    pass
+
+
+@replicas.command('sync')
+def sync_replicas():
+    """Copy a sqlite primary over sqlite replicas (for trying replicas out locally)."""
+    from flask import current_app
+    from app import db
+    from app.replicas import sync_sqlite_replicas
+    uris = current_app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+    if not uris:
+        raise click.ClickException('SQLALCHEMY_REPLICA_URIS is not set')
+    try:
+        written = sync_sqlite_replicas(db.engine, uris)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for path in written:
+        click.echo(f'Copied the primary to {path}')
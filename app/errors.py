@@ -1,11 +1,14 @@
-from flask import render_template
-from app import app, db
+from flask import Blueprint, render_template
+from app import db
 
-@app.errorhandler(404)
+# app_errorhandler covers every request, not just ones routed to this blueprint
+bp = Blueprint('errors', __name__)
+
+@bp.app_errorhandler(404)
 def not_found_error(error):
     return render_template('404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_error(error):
     # if there is an internal error such as with the database, it will return it back to before the error if a transaction was taking place with the db
     db.session.rollback()
@@ -0,0 +1,115 @@
+import json
+import queue
+import threading
+import time
+from flask import current_app
+from werkzeug.utils import import_string
+
+# pub/sub for pushing live updates (new messages, unread counts) to a user's open pages
+# routes publish after they commit, /messages/stream (server-sent events) hands them to the browser
+#
+# the default broker only reaches pages connected to the same process - set EVENT_BROKER in app config
+# to the import path of another class with the same publish/subscribe/unsubscribe methods
+# (ie one backed by redis pub/sub) when running more than one worker process
+
+
+class InProcessBroker:
+    # how many undelivered events to keep per open page before dropping new ones
+    QUEUE_SIZE = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # user_id -> set of queues, one per open page
+        self._subscribers = {}
+
+    def subscribe(self, user_id):
+        subscription = queue.Queue(maxsize=self.QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(user_id)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[user_id]
+
+    def publish(self, user_id, event):
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.put_nowait(event)
+            except queue.Full:
+                # page isn't reading (tab asleep etc) - it gets the latest counts when it reconnects anyway
+                pass
+
+
+_broker_lock = threading.Lock()
+
+
+# the broker for the current app - each app gets its own, made from its own EVENT_BROKER setting
+def get_broker():
+    app = current_app._get_current_object()
+    broker = app.extensions.get('event_broker')
+    if broker is None:
+        with _broker_lock:
+            broker = app.extensions.get('event_broker')
+            if broker is None:
+                broker_class = app.config.get('EVENT_BROKER', InProcessBroker)
+                if isinstance(broker_class, str):
+                    broker_class = import_string(broker_class)
+                broker = app.extensions['event_broker'] = broker_class()
+    return broker
+
+
+# let a user's open pages know their unread count changed
+def publish_unread_count(user):
+    get_broker().publish(user.id, {'type': 'unread', 'unread_count': user.unread_count})
+
+
+# let the recipient's open pages know a message arrived (call after the message is committed)
+def publish_new_message(message, recipient):
+    get_broker().publish(recipient.id, {
+        'type': 'message',
+        'message_id': message.id,
+        'sender_id': message.sender_requester_id,
+        'puzzle_id': message.puzzle_id,
+        'unread_count': recipient.unread_count
+    })
+
+
+# generator of server-sent event lines for one page
+# sends a comment every heartbeat seconds so proxies don't close the connection, and ends after
+# max_seconds so a worker thread isn't tied up forever (EventSource reconnects by itself)
+def event_stream(user_id, first_event, heartbeat=15, max_seconds=300):
+    broker = get_broker()
+
+    def generate():
+        # subscribe once the response actually starts streaming so a response that's never sent can't leak a queue
+        subscription = broker.subscribe(user_id)
+        try:
+            # tell the browser how long to wait before reconnecting, then bring it up to date
+            yield 'retry: 3000\n\n'
+            yield format_event(first_event)
+            deadline = time.monotonic() + max_seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = subscription.get(timeout=min(heartbeat, remaining))
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_event(event)
+        finally:
+            broker.unsubscribe(user_id, subscription)
+
+    return generate()
+
+
+def format_event(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
@@ -56,7 +56,7 @@ class CreatePuzzleForm(FlaskForm):
     # ***add FileAllowed extensions
     image = FileField('Image', validators=[ FileAllowed(['jpg', 'jpeg', 'png', 'svg'])])
     existing_image_url = HiddenField('existing_img_url')
-    categories = SelectMultipleField('Categories', choices=[])
+    categories = SelectMultipleField('Categories', choices=[], coerce=int)
     description = TextAreaField('Additional Notes', validators=[Length(min=0, max=140)])
     submit = SubmitField('Submit')
 
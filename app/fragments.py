@@ -0,0 +1,31 @@
+from jinja2 import nodes
+from jinja2.ext import Extension
+from app.cache import ResultCache
+
+# rendered bits of templates, ie one puzzle card each - FRAGMENT_CACHE_SIZE / FRAGMENT_CACHE_TTL in app config
+# keys have to include everything the fragment's html depends on (see _puzzle.html)
+fragment_cache = ResultCache('FRAGMENT_CACHE', default_size=2048, default_ttl=3600)
+
+
+# adds a {% cache key, ... %}...{% endcache %} tag to templates
+# the body is only rendered when there's nothing cached for the key
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_cached_fragment', [nodes.List(key_parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _cached_fragment(self, key_parts, caller):
+        key = tuple(key_parts)
+        fragment = fragment_cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            fragment_cache.set(key, fragment)
+        return fragment
@@ -0,0 +1,107 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+from app.models import Puzzle
+from app.cache import bump_catalog_version
+from config import Config
+
+# Pillow is optional - without it puzzles just keep showing the original upload
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# widths (px) of the resized copies made for each upload
+# cards are 15rem wide so 240 covers normal screens and 480 covers 2x (retina) screens
+VARIANT_WIDTHS = {
+    'thumb': 240,
+    'medium': 480,
+}
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 78
+
+# image work happens off the request thread so uploading doesn't wait for resizing
+# (IMAGE_WORKERS in app config sets the pool size, default 2 - each app gets a pool of its own)
+_executor_lock = threading.Lock()
+
+
+def _get_executor(app):
+    executor = app.extensions.get('image_variants')
+    if executor is None:
+        with _executor_lock:
+            executor = app.extensions.get('image_variants')
+            if executor is None:
+                executor = app.extensions['image_variants'] = ThreadPoolExecutor(
+                    max_workers=app.config.get('IMAGE_WORKERS', 2),
+                    thread_name_prefix='image-variants'
+                )
+    return executor
+
+
+# queue up resizing for a freshly saved upload
+# filename is what Config.photos.save() returned, image_url the url it's served at
+def queue_variants(puzzle_id, filename, image_url):
+    if Image is None:
+        return None
+    app = current_app._get_current_object()
+    # tests (and anyone who sets IMAGE_VARIANTS_SYNC) get the variants made right away
+    if app.config.get('IMAGE_VARIANTS_SYNC'):
+        return _process(app, puzzle_id, filename, image_url)
+    return _get_executor(app).submit(_process, app, puzzle_id, filename, image_url)
+
+
+def _process(app, puzzle_id, filename, image_url):
+    with app.app_context():
+        try:
+            variants = make_variants(filename, image_url)
+        except Exception:
+            # svgs, corrupt files etc - the card falls back to the original image
+            app.logger.exception('Could not make image variants for %s', filename)
+            return None
+        # only record them if the puzzle still uses this image (it may have been edited again in the meantime)
+        db.session.execute(
+            sa.update(Puzzle).where(Puzzle.id == puzzle_id, Puzzle.image_url == image_url).values(
+                image_variants=variants, version=Puzzle.version + 1),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+        db.session.remove()
+        # cached feed pages still have the old (variant-less) puzzle
+        bump_catalog_version()
+        return variants
+
+
+# writes a jpeg and a webp copy of the image at each width next to the original
+# returns {'thumb': url, 'thumb_webp': url, 'medium': url, 'medium_webp': url}
+def make_variants(filename, image_url):
+    folder = Config.UPLOADED_PHOTOS_DEST
+    url_prefix = image_url.rsplit('/', 1)[0]
+    stem = os.path.splitext(filename)[0]
+    variants = {}
+    with Image.open(os.path.join(folder, filename)) as original:
+        # phone photos are often stored sideways with a rotate flag
+        original = ImageOps.exif_transpose(original)
+        has_alpha = original.mode in ('RGBA', 'LA') or 'transparency' in original.info
+        for name, width in VARIANT_WIDTHS.items():
+            webp_name = f'{stem}_{name}.webp'
+            fallback_name = f'{stem}_{name}.png' if has_alpha else f'{stem}_{name}.jpg'
+            variants[name] = f'{url_prefix}/{fallback_name}'
+            variants[f'{name}_webp'] = f'{url_prefix}/{webp_name}'
+            # uploads are named by their content hash so if these exist they came from the same image
+            if os.path.exists(os.path.join(folder, webp_name)) and os.path.exists(os.path.join(folder, fallback_name)):
+                continue
+            resized = original.copy()
+            # never upscale - thumbnail keeps the aspect ratio and only shrinks
+            resized.thumbnail((width, width * 4))
+            if has_alpha:
+                resized = resized.convert('RGBA')
+                resized.save(os.path.join(folder, fallback_name), 'PNG', optimize=True)
+            else:
+                resized = resized.convert('RGB')
+                resized.save(os.path.join(folder, fallback_name), 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            resized.save(os.path.join(folder, webp_name), 'WEBP', quality=WEBP_QUALITY, method=4)
+    return variants
@@ -0,0 +1,108 @@
+import atexit
+import threading
+import time
+import weakref
+from datetime import datetime, timezone, timedelta
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+from app.models import User
+
+
+# keeps users' last_seen times in memory and writes them to the db in one batch every so often,
+# instead of a commit on every request
+# each app gets a tracker of its own (see current_tracker) writing to that app's database
+# settings (seconds) read from app config:
+#   LAST_SEEN_GRANULARITY - only record a new time for a user if the last one is at least this old (default 60)
+#   LAST_SEEN_FLUSH_INTERVAL - how often the buffered times get written out (default 30)
+class LastSeenTracker:
+    def __init__(self, engine, logger):
+        self._lock = threading.Lock()
+        # user_id -> time seen, waiting to be written
+        self._pending = {}
+        # user_id -> last time recorded for that user (written or not), for the granularity check
+        self._recorded = {}
+        self._last_flush = time.monotonic()
+        # kept so the atexit flush can still write (and say why it couldn't) without an app context
+        self._engine = engine
+        self._logger = logger
+
+    # call on every request from a logged in user - cheap, no db access unless a flush is due
+    def touch(self, user_id):
+        config = current_app.config
+        granularity = timedelta(seconds=config.get('LAST_SEEN_GRANULARITY', 60))
+        interval = config.get('LAST_SEEN_FLUSH_INTERVAL', 30)
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            recorded = self._recorded.get(user_id)
+            if recorded is None or now - recorded >= granularity:
+                self._recorded[user_id] = now
+                self._pending[user_id] = now
+            flush_due = time.monotonic() - self._last_flush >= interval
+            if flush_due:
+                # anyone not seen within the granularity window has already been written (or is about to be)
+                # so forget them to keep this from growing with every user that ever logged in
+                self._recorded = {id: seen for id, seen in self._recorded.items() if now - seen < granularity}
+        if flush_due:
+            self.flush()
+
+    # most recent time we've seen this user (including times not written to the db yet), or None
+    def seen_at(self, user_id):
+        with self._lock:
+            return self._recorded.get(user_id)
+
+    # write everything buffered in one executemany UPDATE on its own connection
+    # (so it never commits whatever the current request has in its session)
+    # best effort - it runs inside whichever request happens to be due, so a database error (ie "database is
+    # locked") is logged and the times kept for the next flush rather than failing that request
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+        rows = [{'user_id': user_id, 'seen': seen} for user_id, seen in pending.items()]
+        statement = sa.update(User.__table__).where(
+            User.__table__.c.id == sa.bindparam('user_id')
+        ).values(last_seen=sa.bindparam('seen'))
+        try:
+            # begin() rolls the UPDATE back if it fails part way
+            with self._engine.begin() as connection:
+                connection.execute(statement, rows)
+        except sa.exc.SQLAlchemyError as e:
+            # put them back (keeping any newer times) so the next flush tries again
+            with self._lock:
+                for user_id, seen in pending.items():
+                    self._pending.setdefault(user_id, seen)
+            self._logger.warning('Could not write last_seen for %d user(s), will try again: %s', len(rows), e)
+            return 0
+        return len(rows)
+
+
+# every tracker made, so the atexit flush can reach them all (an app that's gone takes its tracker with it)
+_trackers = weakref.WeakSet()
+_trackers_lock = threading.Lock()
+
+
+# the tracker for the current app
+def current_tracker():
+    app = current_app._get_current_object()
+    tracker = app.extensions.get('last_seen')
+    if tracker is None:
+        with _trackers_lock:
+            tracker = app.extensions.get('last_seen')
+            if tracker is None:
+                tracker = app.extensions['last_seen'] = LastSeenTracker(db.engine, app.logger)
+                _trackers.add(tracker)
+    return tracker
+
+
+# don't lose the last few seconds of activity when the worker shuts down
+@atexit.register
+def _flush_on_exit():
+    for tracker in list(_trackers):
+        try:
+            tracker.flush()
+        except Exception:
+            pass
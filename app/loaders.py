@@ -0,0 +1,17 @@
+import sqlalchemy.orm as so
+from app.models import Puzzle, Message
+
+# what to load along with the rows a page renders, so a template touching a relationship doesn't run a SELECT per row
+# every query that feeds one of these templates goes through the matching function below
+
+
+# _puzzle.html shows each card's author and categories - the author comes in the same query and the categories
+# in one more for the whole page (a join would repeat every puzzle once per category)
+def with_puzzle_cards(select):
+    return select.options(so.joinedload(Puzzle.author), so.selectinload(Puzzle.categories))
+
+
+# _thread.html shows each message's author, recipient and puzzle - all many-to-one, so they're joined into the
+# thread query itself and a thread of any length renders with no queries of its own
+def with_thread_messages(select):
+    return select.options(so.joinedload(Message.author), so.joinedload(Message.recipient), so.joinedload(Message.puzzle))
@@ -0,0 +1,235 @@
+import json
+import random
+import re
+import threading
+import time
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import build_opener, HTTPCookieProcessor, HTTPRedirectHandler, Request
+import sqlalchemy as sa
+from flask import current_app
+from werkzeug.serving import make_server, WSGIRequestHandler
+from app import db
+from app.models import User, Puzzle
+from app.bench import PASSWORD, USERNAME_PREFIX, SEARCH_QUERY, percentile
+
+# concurrent load against a running server (run with `flask loadtest run`)
+#
+# each simulated user is a thread with its own cookies that logs in and then loops through the
+# scenario steps until time runs out - browse the feed, search, ask for someone's puzzle (send_message),
+# approve/decline a request on one of their own puzzles (request_action) and read their messages
+# by default the app is served from this process on a free local port with werkzeug's threaded server,
+# pass a url to aim at a server started some other way (ie gunicorn with several workers)
+# logs in as users made by `flask bench seed`, which all share one password
+
+STEPS = ('login', 'feed', 'search', 'send_message', 'request_action', 'read')
+
+CSRF_TOKEN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+# don't follow redirects - every write answers with one and we only want to time the write itself
+class NoRedirect(HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+# werkzeug logs every request, which would bury the results
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class SimulatedUser:
+    def __init__(self, base_url, username, own_puzzles, others_puzzles, usernames, rng, timeout):
+        self.base_url = base_url
+        self.username = username
+        # ids of puzzles this user owns (for request_action)
+        self.own_puzzles = own_puzzles
+        # (puzzle id, owner id) of puzzles other people own (for send_message)
+        self.others_puzzles = others_puzzles
+        self.usernames = usernames
+        self.rng = rng
+        self.timeout = timeout
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()), NoRedirect)
+        # step -> list of seconds, step -> number of failures
+        self.timings = {step: [] for step in STEPS}
+        self.errors = {step: 0 for step in STEPS}
+
+    def fetch(self, path, data=None, json_body=None):
+        headers = {}
+        if json_body is not None:
+            data = json.dumps(json_body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            data = urlencode(data).encode('utf-8')
+        request = Request(self.base_url + path, data=data, headers=headers)
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                return response.status, response.read(), response.headers
+        except HTTPError as e:
+            # redirects come back as errors because NoRedirect doesn't follow them
+            return e.code, e.read(), e.headers
+
+    # runs one step, recording how long it took and whether it worked
+    def step(self, name, action):
+        started = time.perf_counter()
+        try:
+            status, body, headers = action()
+            ok = status < 400
+        except (URLError, OSError):
+            ok = False
+            body = None
+        self.timings[name].append(time.perf_counter() - started)
+        if not ok:
+            self.errors[name] += 1
+        return body if ok else None
+
+    def login(self):
+        def action():
+            status, body, headers = self.fetch('/login')
+            token = CSRF_TOKEN.search(body.decode('utf-8', 'replace'))
+            form = {'username': self.username, 'password': PASSWORD}
+            if token:
+                form['csrf_token'] = token.group(1)
+            status, body, headers = self.fetch('/login', data=form)
+            # a good login redirects on to the site, a bad one redirects back to /login
+            if status != 302 or '/login' in headers.get('Location', ''):
+                status = 401
+            return status, body, headers
+        return self.step('login', action) is not None
+
+    def feed(self):
+        self.step('feed', lambda: self.fetch('/index'))
+
+    def search(self):
+        self.step('search', lambda: self.fetch('/index?' + urlencode({'query': SEARCH_QUERY})))
+
+    def send_message(self):
+        if not self.others_puzzles:
+            return
+        puzzle_id, owner_id = self.rng.choice(self.others_puzzles)
+        self.step('send_message', lambda: self.fetch('/send_message', data={
+            'recipient_id': owner_id, 'puzzle_id': puzzle_id, 'content': 'Is this one still available?'}))
+
+    def request_action(self):
+        if not self.own_puzzles:
+            return
+        # mostly decline so puzzles stay with their owners and the scenario can keep running
+        action = 'approve' if self.rng.random() < 0.1 else 'decline'
+        puzzle_id = self.rng.choice(self.own_puzzles)
+        requester = self.rng.choice(self.usernames)
+        if action == 'approve':
+            self.own_puzzles.remove(puzzle_id)
+        self.step('request_action', lambda: self.fetch('/request_action', data={
+            'action': action, 'requester': requester, 'puzzle_id': puzzle_id, 'personal_note': 'Load test'}))
+
+    def read(self):
+        def action():
+            status, body, headers = self.fetch('/messages')
+            if status >= 400 or not self.others_puzzles:
+                return status, body, headers
+            # mark one conversation read the way messages.html does
+            puzzle_id, owner_id = self.rng.choice(self.others_puzzles)
+            return self.fetch('/messages/read', json_body={'sender_id': owner_id, 'puzzle_id': puzzle_id})
+        self.step('read', action)
+
+    def run(self, deadline, think_time):
+        if not self.login():
+            return
+        scenario = (self.feed, self.search, self.send_message, self.request_action, self.read)
+        while time.monotonic() < deadline:
+            for action in scenario:
+                if time.monotonic() >= deadline:
+                    break
+                action()
+                if think_time:
+                    time.sleep(self.rng.uniform(0, think_time * 2))
+
+
+def summarize(users, elapsed):
+    steps = {}
+    total_requests = total_errors = 0
+    for step in STEPS:
+        timings = [timing for user in users for timing in user.timings[step]]
+        errors = sum(user.errors[step] for user in users)
+        total_requests += len(timings)
+        total_errors += errors
+        if not timings:
+            continue
+        steps[step] = {
+            'requests': len(timings),
+            'errors': errors,
+            'error_rate': round(errors / len(timings), 4),
+            'per_second': round(len(timings) / elapsed, 2),
+            'p50_ms': round(percentile(timings, 50) * 1000, 3),
+            'p95_ms': round(percentile(timings, 95) * 1000, 3),
+            'p99_ms': round(percentile(timings, 99) * 1000, 3),
+            'max_ms': round(max(timings) * 1000, 3),
+        }
+    return {
+        'requests': total_requests,
+        'errors': total_errors,
+        'error_rate': round(total_errors / total_requests, 4) if total_requests else None,
+        'per_second': round(total_requests / elapsed, 2),
+        'steps': steps,
+    }
+
+
+# picks the simulated users and the puzzles each of them will use from the seeded data
+def plan_users(count, seed):
+    rng = random.Random(seed)
+    users = db.session.execute(
+        sa.select(User.id, User.username)
+        .where(User.username.startswith(USERNAME_PREFIX))
+        .order_by(User.id)
+        .limit(count)).all()
+    if not users:
+        raise ValueError('no benchmark users - run `flask bench seed` first')
+    user_ids = [user.id for user in users]
+    puzzles = db.session.execute(
+        sa.select(Puzzle.id, Puzzle.user_id)
+        .where(Puzzle.is_deleted == False, Puzzle.user_id.in_(user_ids))).all()
+    usernames = [user.username for user in users]
+    plans = []
+    for user in users:
+        own = [puzzle.id for puzzle in puzzles if puzzle.user_id == user.id]
+        others = [(puzzle.id, puzzle.user_id) for puzzle in puzzles if puzzle.user_id != user.id]
+        requesters = [username for username in usernames if username != user.username] or usernames
+        plans.append((user.username, own, others, requesters, random.Random(rng.random())))
+    return plans
+
+
+# runs the load and returns the results as a dict (ready for json.dumps)
+def run(users=10, duration=30, base_url=None, think_time=0.0, timeout=30, seed=0):
+    plans = plan_users(users, seed)
+    server = None
+    if base_url is None:
+        server = make_server('127.0.0.1', 0, current_app._get_current_object(), threaded=True,
+                             request_handler=QuietRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+    base_url = base_url.rstrip('/')
+    simulated = [SimulatedUser(base_url, username, own, others, requesters, rng, timeout)
+                 for username, own, others, requesters, rng in plans]
+    started = time.monotonic()
+    deadline = started + duration
+    threads = [threading.Thread(target=user.run, args=(deadline, think_time)) for user in simulated]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if server is not None:
+            server.shutdown()
+    elapsed = time.monotonic() - started
+    results = summarize(simulated, elapsed)
+    return {
+        'url': base_url,
+        'database': db.engine.dialect.name,
+        'users': len(simulated),
+        'duration_s': round(elapsed, 3),
+        'think_time_s': think_time,
+        **results,
+    }
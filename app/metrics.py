@@ -0,0 +1,188 @@
+import threading
+import time
+from bisect import bisect_left
+from flask import Blueprint, current_app, g, request, Response, abort, before_render_template, template_rendered
+
+# per-route request metrics, served in prometheus text format at /metrics
+#
+# the numbers are split over a fixed number of shards, each with its own lock, and a thread always writes into
+# the same one - so recording a request hardly ever waits on another thread, memory doesn't grow with the number
+# of threads the server has started (werkzeug's threaded server starts one per request), and the shards only
+# get added together when /metrics is scraped
+# METRICS_ENABLED in app config turns collection off (default on)
+# METRICS_TOKEN, if set, has to be sent as "Authorization: Bearer <token>" to read /metrics
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# name -> (type, help text, buckets)
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Time spent handling a request', LATENCY_BUCKETS),
+    'http_response_size_bytes': ('histogram', 'Size of response bodies', SIZE_BUCKETS),
+    'http_requests_total': ('counter', 'Requests handled', None),
+    'sql_statements_per_request': ('histogram', 'SQL statements run by a request', COUNT_BUCKETS),
+    'sql_duration_seconds_total': ('counter', 'Time spent running SQL', None),
+    'template_render_duration_seconds': ('histogram', 'Time spent rendering a template', LATENCY_BUCKETS),
+    'password_hash_duration_seconds': ('histogram', 'Time to hash or check a password, queueing included', LATENCY_BUCKETS),
+    'password_hashes_rejected_total': ('counter', 'Password hashes turned away because the hashing pool was full', None),
+}
+
+
+class _Shard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (name, labels) -> [count per bucket..., sum, count]
+        self.histograms = {}
+        # (name, labels) -> value
+        self.counters = {}
+
+    def merge(self, other):
+        for key, values in other.histograms.items():
+            mine = self.histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                mine[i] += value
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+class MetricsRegistry:
+    def __init__(self, shards=16):
+        self._shards = [_Shard() for _ in range(shards)]
+
+    # the os thread id goes up by one per thread started, so threads running at the same time spread evenly
+    def _shard(self):
+        return self._shards[threading.get_native_id() % len(self._shards)]
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        # first bucket whose upper bound is >= value (bigger than every bound only counts towards +Inf)
+        index = bisect_left(buckets, value)
+        shard = self._shard()
+        with shard.lock:
+            values = shard.histograms.get((name, labels))
+            if values is None:
+                values = shard.histograms[(name, labels)] = [0] * (len(buckets) + 2)
+            if index < len(buckets):
+                values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def inc(self, name, labels, amount=1):
+        shard = self._shard()
+        with shard.lock:
+            shard.counters[(name, labels)] = shard.counters.get((name, labels), 0) + amount
+
+    # add up every shard
+    def collect(self):
+        total = _Shard()
+        for shard in self._shards:
+            with shard.lock:
+                total.merge(shard)
+        return total
+
+    def render(self):
+        total = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(total.counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+                continue
+            for (metric, labels), values in sorted(total.histograms.items()):
+                if metric != name:
+                    continue
+                # prometheus buckets are cumulative (everything <= le)
+                cumulative = 0
+                for bound, count in zip(buckets, values):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", format_value(bound)),))} {cumulative}')
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {values[-1]}')
+                lines.append(f'{name}_sum{format_labels(labels)} {format_value(values[-2])}')
+                lines.append(f'{name}_count{format_labels(labels)} {values[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels) + '}'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
+
+# only hooks - the /metrics route itself is in routes.py
+bp = Blueprint('metrics', __name__)
+
+
+def metrics_enabled():
+    return current_app.config.get('METRICS_ENABLED', True)
+
+
+# streamed responses that stay open as long as the client is connected - how long they take isn't latency
+LONG_LIVED_ENDPOINTS = ('main.message_stream',)
+
+
+# endpoint name rather than the path so urls like /user/<username> don't each get their own series
+def endpoint_label():
+    return request.endpoint or 'unmatched'
+
+
+@bp.before_app_request
+def start_request_timer():
+    if metrics_enabled():
+        g.request_started = time.perf_counter()
+
+
+@bp.after_app_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    endpoint = endpoint_label()
+    labels = (('endpoint', endpoint), ('method', request.method))
+    if endpoint not in LONG_LIVED_ENDPOINTS:
+        registry.observe('http_request_duration_seconds', labels, time.perf_counter() - started)
+    registry.inc('http_requests_total', labels + (('status', response.status_code),))
+    # streamed responses (ie /messages/stream) don't have a length up front
+    if response.content_length is not None:
+        registry.observe('http_response_size_bytes', labels, response.content_length)
+    stats = g.get('sql_stats')
+    if stats is not None:
+        registry.observe('sql_statements_per_request', (('endpoint', endpoint),), stats.count)
+        registry.inc('sql_duration_seconds_total', (('endpoint', endpoint),), stats.seconds)
+    return response
+
+
+def _template_started(sender, template, context, **extra):
+    if metrics_enabled():
+        g.setdefault('template_timers', []).append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    timers = g.get('template_timers')
+    if timers:
+        registry.observe('template_render_duration_seconds', (('template', template.name),), time.perf_counter() - timers.pop())
+
+
+# connected for every app so apps made by create_app() all get timed
+before_render_template.connect(_template_started)
+template_rendered.connect(_template_finished)
+
+
+def metrics_response():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
@@ -4,13 +4,15 @@ import sqlalchemy as sa
 import sqlalchemy.orm as so
 # from sqlalchemy_imageattach.entity import Image, image_attachment
 from datetime import datetime, timezone
-# packages included in flask Werkzeug involved in password hashing for login
-from werkzeug.security import generate_password_hash, check_password_hash
+from collections import Counter
+# password hashing (Werkzeug's hashes, run on a worker pool - see app/passwords.py)
+from app.passwords import hash_password, verify_password, needs_rehash
 # flask-login (UserMixin contains these properties and methods-)
 # is_authenticated, is_active, is_anonymous, get_id()
 from flask_login import UserMixin
 from app import db, login
 from hashlib import md5
+from flask import url_for
 
 
 # create User class
@@ -27,9 +29,14 @@ class User(UserMixin, db.Model):
     email: so.Mapped[str] = so.mapped_column(sa.String(120), unique=True, index=True)
     # in this case, Optional allow column to be nullable or empty
     password_hash: so.Mapped[Optional[str]] = so.mapped_column(sa.String(256))
+    # md5 of the lowercased username, worked out once when the username is set so avatars don't hash on every render
+    avatar_digest: so.Mapped[Optional[str]] = so.mapped_column(sa.String(32))
 
     # messages implementation
     last_message_read_time: so.Mapped[Optional[datetime]]
+    # number of unread messages waiting for this user - kept up to date whenever a message is sent, read or deleted
+    # (see adjust_unread_count) so the badge in the navbar doesn't need a COUNT on every page
+    unread_count: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
     messages_sent: so.WriteOnlyMapped['Message'] = so.relationship(
         foreign_keys='Message.sender_requester_id', back_populates='author'
     )
@@ -44,10 +51,109 @@ class User(UserMixin, db.Model):
         back_populates='author')
     
     def unread_message_count(self):
-        # query all the messages received and filter by unread messages and count rows 
-        
-        # execute and return the count query and get one result with scalar()
-        return db.session.query(Message).filter_by(recipient_owner_id=self.id, is_read=False).count() 
+        # read straight off the user row instead of counting messages every time
+        return self.unread_count
+
+    # adds delta (negative to subtract) to a user's unread count in the same transaction as the message change
+    # done as UPDATE user SET unread_count = unread_count + delta so two requests at once can't lose an update
+    @staticmethod
+    def adjust_unread_count(user_id, delta):
+        if delta:
+            db.session.execute(
+                sa.update(User).where(User.id == user_id).values(unread_count=User.unread_count + delta)
+            )
+
+    # mark a batch of this user's received messages read with one UPDATE and return how many changed
+    # either pass message_ids, or sender_id + puzzle_id (+ optional up_to_id) for a whole conversation
+    def mark_messages_read(self, message_ids=None, sender_id=None, puzzle_id=None, up_to_id=None):
+        conditions = [
+            Message.recipient_owner_id == self.id,
+            Message.is_read == False,
+            # deleted messages aren't on the unread count and aren't shown, so leave them alone
+            Message.is_deleted_by_recipient == False
+        ]
+        if message_ids is not None:
+            if not message_ids:
+                return 0
+            conditions.append(Message.id.in_(message_ids))
+        elif sender_id is not None:
+            conditions.append(Message.sender_requester_id == sender_id)
+            if puzzle_id is not None:
+                conditions.append(Message.puzzle_id == puzzle_id)
+            if up_to_id is not None:
+                conditions.append(Message.id <= up_to_id)
+        else:
+            raise ValueError('mark_messages_read needs message_ids or sender_id')
+        marked = db.session.execute(
+            sa.update(Message).where(*conditions).values(is_read=True)
+            .returning(Message.sender_requester_id, Message.puzzle_id),
+            execution_options={'synchronize_session': False}
+        ).all()
+        # each conversation's own count goes down by however many of its messages were marked
+        Conversation.subtract_unread(self.id, Counter(marked))
+        User.adjust_unread_count(self.id, -len(marked))
+        return len(marked)
+
+    # mark everything waiting for this user read with one UPDATE and return how many changed
+    def mark_all_messages_read(self):
+        marked = db.session.execute(
+            sa.update(Message).where(
+                Message.recipient_owner_id == self.id,
+                Message.is_read == False,
+                Message.is_deleted_by_recipient == False
+            ).values(is_read=True),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+        User.adjust_unread_count(self.id, -marked)
+        Conversation.mark_read(self.id)
+        return marked
+
+    # soft delete whole threads on this user's side - threads is a list of (other user id, puzzle id)
+    # done with a fixed number of UPDATEs however many messages the threads hold, returns how many messages were deleted
+    def delete_threads(self, threads):
+        threads = [(int(other_id), int(puzzle_id)) for other_id, puzzle_id in threads]
+        if not threads:
+            return 0
+        sent = sa.and_(
+            Message.sender_requester_id == self.id,
+            sa.tuple_(Message.recipient_owner_id, Message.puzzle_id).in_(threads),
+            Message.is_deleted_by_sender == False
+        )
+        received = sa.and_(
+            Message.recipient_owner_id == self.id,
+            sa.tuple_(Message.sender_requester_id, Message.puzzle_id).in_(threads),
+            Message.is_deleted_by_recipient == False
+        )
+        deleted = db.session.execute(
+            sa.update(Message).where(sent).values(is_deleted_by_sender=True),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+        # unread messages come off the badge count when they're deleted - which ones were unread comes back from
+        # the UPDATE itself so a mark-as-read landing at the same moment can't make the count drift
+        was_read = db.session.scalars(
+            sa.update(Message).where(received).values(is_deleted_by_recipient=True).returning(Message.is_read),
+            execution_options={'synchronize_session': False}
+        ).all()
+        deleted += len(was_read)
+        User.adjust_unread_count(self.id, -was_read.count(False))
+        Conversation.mark_deleted(self.id, threads)
+        return deleted
+
+    # recount every user's unread messages from the message table and fix the stored counts
+    # (used by `flask messages reconcile-unread` in case the counts ever drift)
+    @staticmethod
+    def reconcile_unread_counts():
+        actual_count = sa.select(sa.func.count(Message.id)).where(
+            Message.recipient_owner_id == User.id,
+            Message.is_read == False,
+            Message.is_deleted_by_recipient == False
+        ).scalar_subquery()
+        result = db.session.execute(
+            sa.update(User).where(User.unread_count != actual_count).values(unread_count=actual_count),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+        return result.rowcount
 
     def unread_message_counts_by_sender(self):
         unread_counts_by_sender = db.session.query(
@@ -58,28 +164,75 @@ class User(UserMixin, db.Model):
                 Message.recipient_owner_id == self.id,
          
             
-            Message.is_read == False
+            Message.is_read == False,
+            # deleted messages don't count as waiting to be read
+            Message.is_deleted_by_recipient == False
         ).group_by(
             Message.sender_requester_id
         ).all()   
         return {sender_id: count for sender_id, count in unread_counts_by_sender}
+
+    # everything the messages sidebar needs - every user this user has a conversation with, the puzzles
+    # of the threads they haven't deleted and the unread count from each user - in 3 queries total
+    # read from the conversation table (see Conversation) so it costs the same however many messages there are
+    # returns list of {'sender': User, 'puzzles': [Puzzle], 'unread_count': int}, most recently active first
+    def conversation_partners(self):
+        conversations = db.session.scalars(
+            sa.select(Conversation).where(
+                sa.or_(Conversation.user_a_id == self.id, Conversation.user_b_id == self.id)
+            ).order_by(Conversation.last_activity.desc())
+        ).all()
+        if not conversations:
+            return []
+
+        # other user id -> their conversations' puzzle ids and unread count, in the order they were last active
+        partners = {}
+        for conversation in conversations:
+            partner = partners.setdefault(conversation.other_user_id(self.id), {'puzzle_ids': [], 'unread_count': 0})
+            partner['unread_count'] += conversation.unread_count_for(self.id)
+            if not conversation.is_deleted_by(self.id):
+                partner['puzzle_ids'].append(conversation.puzzle_id)
+
+        users = {user.id: user for user in db.session.scalars(sa.select(User).where(User.id.in_(partners.keys())))}
+        all_puzzle_ids = {puzzle_id for partner in partners.values() for puzzle_id in partner['puzzle_ids']}
+        puzzles = {}
+        if all_puzzle_ids:
+            puzzles = {puzzle.id: puzzle for puzzle in db.session.scalars(sa.select(Puzzle).where(Puzzle.id.in_(all_puzzle_ids)))}
+
+        return [{
+            'sender': users[user_id],
+            'puzzles': [puzzles[puzzle_id] for puzzle_id in partner['puzzle_ids'] if puzzle_id in puzzles],
+            'unread_count': partner['unread_count']
+        } for user_id, partner in partners.items() if user_id in users]
     # this built in function of objects returns printable representation of the object
     # generally used to make debugging easier
     def __repr__(self):
         return '<User {}>'.format(self.username)
 
     # generates hash based on user input (password)
+    # these raise PasswordHashingBusy when too many passwords are being hashed at once
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     # checks to see if user's inputted password matches password hash created
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+
+    # True when the stored hash was made with older hash settings and should be redone
+    def password_needs_rehash(self):
+        return needs_rehash(self.password_hash)
     
+    # keep avatar_digest in step with the username (covers registering and editing the profile)
+    @so.validates('username')
+    def validate_username(self, key, username):
+        self.avatar_digest = md5(username.lower().encode('utf-8')).hexdigest()
+        return username
+
     # creating avatars for users
+    # identicons are drawn and cached by the app itself (see app/avatars.py)
     def create_avatar(self, size):
-        digest = md5(self.username.lower().encode('utf-8)')).hexdigest()
-        return f'https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}'
+        digest = self.avatar_digest or md5(self.username.lower().encode('utf-8')).hexdigest()
+        return url_for('main.avatar', digest=digest, size=size)
 
 # ***association table b/w puzzle and category
 puzzle_category = sa.Table(
@@ -110,6 +263,9 @@ class Category(db.Model):
 class Puzzle(db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     image_url: so.Mapped[str] = so.mapped_column(nullable=False)
+    # urls of the resized copies of the image made after upload (see app/images.py)
+    # ie {'thumb': ..., 'thumb_webp': ..., 'medium': ..., 'medium_webp': ...} - None until they're ready
+    image_variants: so.Mapped[Optional[dict]] = so.mapped_column(sa.JSON)
     pieces: so.Mapped[int]
     condition: so.Mapped[str] = so.mapped_column(sa.String(64), nullable=True)
     title: so.Mapped[str] = so.mapped_column(sa.String(64))
@@ -124,6 +280,9 @@ class Puzzle(db.Model):
     # foreign key (primary key on User table)
     user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), index=True)
 
+    # goes up by one every time the puzzle is changed - rendered cards are cached by it (see _puzzle.html)
+    version: so.Mapped[int] = so.mapped_column(default=1, server_default='1')
+
     # connects to User table
     author: so.Mapped[User] = so.relationship(back_populates='puzzles')
  
@@ -132,6 +291,25 @@ class Puzzle(db.Model):
 
     def __repr__(self):
         return '<Puzzle {}>'.format(self.id)
+
+# any edit or status change (available/requested/in progress/deleted) makes a new version of the puzzle
+# done in the UPDATE itself (SET version = version + 1) so two edits at once can't both write the same version
+@sa.event.listens_for(Puzzle, 'before_update')
+def bump_puzzle_version(mapper, connection, target):
+    # before_update also runs for a puzzle whose attributes were only set to the values they already had
+    if so.object_session(target).is_modified(target):
+        target.version = Puzzle.version + 1
+
+# inverted index for the home page search (one row per term per puzzle)
+# kept in sync by app/search.py whenever a puzzle is saved or deleted
+class PuzzleSearchTerm(db.Model):
+    term: so.Mapped[str] = so.mapped_column(sa.String(64), primary_key=True)
+    puzzle_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Puzzle.id), primary_key=True, index=True)
+    # how much a match on this term counts towards the ranking (title matches count more than description matches)
+    weight: so.Mapped[int]
+
+    def __repr__(self):
+        return '<PuzzleSearchTerm {} {}>'.format(self.term, self.puzzle_id)
     
 # Message
 class Message(db.Model):
@@ -169,6 +347,214 @@ class Message(db.Model):
     def __repr__(self):
         return '<Message{}>'.format(self.content)
 
+# one row per conversation (two users talking about one puzzle) so the inbox reads a handful of rows instead of
+# grouping every message the user was ever part of - kept up to date whenever a message is sent, read or deleted
+# user_a is always the lower of the two user ids so a pair only has one row, and the _a/_b columns are that user's side
+class Conversation(db.Model):
+    user_a_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), primary_key=True)
+    user_b_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), primary_key=True)
+    puzzle_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Puzzle.id), primary_key=True)
+    last_message_id: so.Mapped[Optional[int]] = so.mapped_column(sa.ForeignKey(Message.id))
+    last_activity: so.Mapped[datetime] = so.mapped_column(default=lambda: datetime.now(timezone.utc))
+    # unread messages waiting for each side (the same messages User.unread_count counts)
+    unread_count_a: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
+    unread_count_b: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
+    # True once that side has deleted every message in the conversation - a new message brings it back
+    is_deleted_by_a: so.Mapped[bool] = so.mapped_column(default=False, server_default=sa.false())
+    is_deleted_by_b: so.Mapped[bool] = so.mapped_column(default=False, server_default=sa.false())
+
+    # the (user_a_id, user_b_id, puzzle_id) primary key of the conversation between two users about a puzzle
+    @staticmethod
+    def key(user_id, other_id, puzzle_id):
+        user_id, other_id = int(user_id), int(other_id)
+        return min(user_id, other_id), max(user_id, other_id), int(puzzle_id) if puzzle_id is not None else None
+
+    # 'a' or 'b' - which side of its conversations with other_id user_id is on
+    @staticmethod
+    def side(user_id, other_id):
+        return 'a' if int(user_id) < int(other_id) else 'b'
+
+    @staticmethod
+    def between(user_id, other_id, puzzle_id):
+        return db.session.get(Conversation, Conversation.key(user_id, other_id, puzzle_id))
+
+    @staticmethod
+    def _update(user_id, other_id, puzzle_id, values):
+        user_a_id, user_b_id, puzzle_id = Conversation.key(user_id, other_id, puzzle_id)
+        return db.session.execute(
+            sa.update(Conversation).where(
+                Conversation.user_a_id == user_a_id,
+                Conversation.user_b_id == user_b_id,
+                Conversation.puzzle_id == puzzle_id
+            ).values(values),
+            execution_options={'synchronize_session': False}
+        )
+
+    # call after adding a new message to the session - starts the conversation or moves it to the top of both inboxes
+    @staticmethod
+    def record_message(message):
+        # the message needs its id (and its sender/recipient ids if it was made with author=/recipient=)
+        db.session.flush()
+        unread = getattr(Conversation, 'unread_count_' + Conversation.side(message.recipient_owner_id, message.sender_requester_id))
+        values = {
+            Conversation.last_message_id: message.id,
+            Conversation.last_activity: message.timestamp,
+            Conversation.is_deleted_by_a: False,
+            Conversation.is_deleted_by_b: False,
+        }
+        if Conversation._update(message.sender_requester_id, message.recipient_owner_id, message.puzzle_id,
+                                {**values, unread: unread + 1}).rowcount:
+            return
+        user_a_id, user_b_id, puzzle_id = Conversation.key(message.sender_requester_id, message.recipient_owner_id, message.puzzle_id)
+        try:
+            with db.session.begin_nested():
+                db.session.execute(sa.insert(Conversation).values(
+                    {**values, Conversation.user_a_id: user_a_id, Conversation.user_b_id: user_b_id,
+                     Conversation.puzzle_id: puzzle_id, unread: 1}))
+        except sa.exc.IntegrityError:
+            # the other user started the same conversation at the same moment
+            Conversation._update(message.sender_requester_id, message.recipient_owner_id, message.puzzle_id,
+                                 {**values, unread: unread + 1})
+
+    # adds delta (negative to subtract) to recipient_id's unread count for the conversation, like User.adjust_unread_count
+    @staticmethod
+    def adjust_unread(recipient_id, sender_id, puzzle_id, delta):
+        if delta:
+            unread = getattr(Conversation, 'unread_count_' + Conversation.side(recipient_id, sender_id))
+            Conversation._update(recipient_id, sender_id, puzzle_id, {unread: unread + delta})
+
+    # takes read messages off recipient_id's unread counts - counts maps (sender id, puzzle id) to how many of that
+    # conversation's messages were read, and every conversation is done in the same two UPDATEs however many there are
+    @staticmethod
+    def subtract_unread(recipient_id, counts):
+        if not counts:
+            return 0
+
+        def values(side):
+            other_id = Conversation.user_b_id if side == 'a' else Conversation.user_a_id
+            unread = getattr(Conversation, 'unread_count_' + side)
+            read = sa.case(*[(sa.and_(other_id == sender_id, Conversation.puzzle_id == puzzle_id), count)
+                             for (sender_id, puzzle_id), count in counts.items()], else_=0)
+            return {unread: unread - read}
+
+        return Conversation._update_sides(recipient_id, values, list(counts))
+
+    # runs an UPDATE on user_id's side of their conversations, once with them as user_a and once as user_b
+    # values(side) gives the values to set for side 'a' or 'b', threads optionally limits it to (other user id, puzzle id)s
+    @staticmethod
+    def _update_sides(user_id, values, threads=None):
+        updated = 0
+        for side, own_id, other_id in (('a', Conversation.user_a_id, Conversation.user_b_id),
+                                       ('b', Conversation.user_b_id, Conversation.user_a_id)):
+            conditions = [own_id == user_id]
+            if threads is not None:
+                conditions.append(sa.tuple_(other_id, Conversation.puzzle_id).in_(threads))
+            updated += db.session.execute(
+                sa.update(Conversation).where(*conditions).values(values(side)),
+                execution_options={'synchronize_session': False}
+            ).rowcount
+        return updated
+
+    # user_id has deleted whole conversations (threads is a list of (other user id, puzzle id)) - nothing is left
+    # unread on their side
+    @staticmethod
+    def mark_deleted(user_id, threads):
+        return Conversation._update_sides(user_id, lambda side: {
+            getattr(Conversation, 'is_deleted_by_' + side): True,
+            getattr(Conversation, 'unread_count_' + side): 0
+        }, threads)
+
+    # user_id has read everything in every conversation
+    @staticmethod
+    def mark_read(user_id):
+        return Conversation._update_sides(user_id, lambda side: {getattr(Conversation, 'unread_count_' + side): 0})
+
+    # after user_id deletes a single message - the conversation counts as deleted for them once none of it is left
+    @staticmethod
+    def refresh_deleted(user_id, other_id, puzzle_id):
+        still_visible = sa.exists().where(
+            Message.puzzle_id == puzzle_id,
+            sa.or_(
+                sa.and_(Message.sender_requester_id == user_id, Message.recipient_owner_id == other_id,
+                        Message.is_deleted_by_sender == False),
+                sa.and_(Message.recipient_owner_id == user_id, Message.sender_requester_id == other_id,
+                        Message.is_deleted_by_recipient == False)
+            )
+        )
+        Conversation._update(user_id, other_id, puzzle_id, {
+            getattr(Conversation, 'is_deleted_by_' + Conversation.side(user_id, other_id)): ~still_visible
+        })
+
+    # throw away every conversation row and build them again from the message table
+    # (used by `flask messages rebuild-conversations` and after `flask bench seed`) - returns how many there are
+    @staticmethod
+    def rebuild():
+        user_a_id = sa.case((Message.sender_requester_id < Message.recipient_owner_id, Message.sender_requester_id),
+                            else_=Message.recipient_owner_id)
+        user_b_id = sa.case((Message.sender_requester_id < Message.recipient_owner_id, Message.recipient_owner_id),
+                            else_=Message.sender_requester_id)
+        unread = sa.and_(Message.is_read == False, Message.is_deleted_by_recipient == False)
+
+        def visible_to(user_id):
+            return sa.or_(
+                sa.and_(Message.sender_requester_id == user_id, Message.is_deleted_by_sender == False),
+                sa.and_(Message.recipient_owner_id == user_id, Message.is_deleted_by_recipient == False)
+            )
+
+        conversations = sa.select(
+            user_a_id,
+            user_b_id,
+            Message.puzzle_id,
+            # ids only go up so the newest message has the highest one
+            sa.func.max(Message.id),
+            sa.func.max(Message.timestamp),
+            sa.func.count(Message.id).filter(Message.recipient_owner_id == user_a_id, unread),
+            sa.func.count(Message.id).filter(Message.recipient_owner_id == user_b_id, unread),
+            sa.func.count(Message.id).filter(visible_to(user_a_id)) == 0,
+            sa.func.count(Message.id).filter(visible_to(user_b_id)) == 0
+        ).where(
+            Message.puzzle_id != None
+        ).group_by(user_a_id, user_b_id, Message.puzzle_id)
+        db.session.execute(sa.delete(Conversation))
+        db.session.execute(sa.insert(Conversation).from_select(
+            ['user_a_id', 'user_b_id', 'puzzle_id', 'last_message_id', 'last_activity',
+             'unread_count_a', 'unread_count_b', 'is_deleted_by_a', 'is_deleted_by_b'],
+            conversations
+        ))
+        db.session.commit()
+        return db.session.scalar(sa.select(sa.func.count()).select_from(Conversation))
+
+    def other_user_id(self, user_id):
+        return self.user_b_id if user_id == self.user_a_id else self.user_a_id
+
+    def unread_count_for(self, user_id):
+        return self.unread_count_a if user_id == self.user_a_id else self.unread_count_b
+
+    def is_deleted_by(self, user_id):
+        return self.is_deleted_by_a if user_id == self.user_a_id else self.is_deleted_by_b
+
+    def __repr__(self):
+        return '<Conversation {} {} {}>'.format(self.user_a_id, self.user_b_id, self.puzzle_id)
+
+# composite/partial indexes for the hot queries (`flask indexes check` makes sure each of them still uses one)
+# the partial ones only hold the rows those queries can match, so they stay small as the tables grow
+# - unread counts by sender and marking a conversation read only look at unread messages the recipient still has
+sa.Index('ix_message_unread_by_sender', Message.recipient_owner_id, Message.sender_requester_id, Message.puzzle_id,
+         sqlite_where=sa.and_(Message.is_read == False, Message.is_deleted_by_recipient == False),
+         postgresql_where=sa.and_(Message.is_read == False, Message.is_deleted_by_recipient == False))
+# - a thread is (sender, recipient, puzzle) in both directions, each direction paged by (timestamp, id)
+sa.Index('ix_message_thread', Message.sender_requester_id, Message.recipient_owner_id, Message.puzzle_id,
+         Message.timestamp, Message.id)
+# - the home page feed, newest available puzzles first
+sa.Index('ix_puzzle_feed', Puzzle.timestamp, Puzzle.id,
+         sqlite_where=Puzzle.is_available == True, postgresql_where=Puzzle.is_available == True)
+# - a user's own puzzles that haven't been deleted
+sa.Index('ix_puzzle_user_active', Puzzle.user_id, Puzzle.timestamp,
+         sqlite_where=Puzzle.is_deleted == False, postgresql_where=Puzzle.is_deleted == False)
+# - the inbox, a user's conversations on either side most recent first
+sa.Index('ix_conversation_user_a_activity', Conversation.user_a_id, Conversation.last_activity)
+sa.Index('ix_conversation_user_b_activity', Conversation.user_b_id, Conversation.last_activity)
+
 # function that will load a user based on their id (stores user's session)
 # flask-login will use this id for the user session so it knows who is logged in
 @login.user_loader
@@ -0,0 +1,91 @@
+import base64
+import binascii
+from datetime import datetime
+import sqlalchemy as sa
+from app import db
+
+
+# one page of results from keyset_paginate - has the same has_next/has_prev/items names as
+# flask-sqlalchemy's Pagination so templates can treat them the same way
+class KeysetPage:
+    def __init__(self, items, has_next, has_prev, next_cursor, prev_cursor):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+# cursors are the (timestamp, id) of the first/last item on a page plus which way to go from it
+# base64'd so the url doesn't invite people to edit them by hand
+def encode_cursor(direction, timestamp, id):
+    raw = f'{direction}|{timestamp.isoformat()}|{id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+# returns (direction, timestamp, id) or None if the cursor is missing or has been tampered with
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        direction, timestamp, id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        if direction not in ('next', 'prev'):
+            return None
+        return direction, datetime.fromisoformat(timestamp), int(id)
+    except (ValueError, binascii.Error, UnicodeError):
+        return None
+
+
+# newest-first pagination on (timestamp, id) - each page is a range scan on the timestamp index
+# starting where the last page stopped, so there is no COUNT(*) and no OFFSET no matter how deep you go
+# timestamp_column/id_column are the columns of the model being selected (ie Puzzle.timestamp, Puzzle.id)
+# branches is for a WHERE that is an OR no one index range covers - pass the sides of the OR (each a tuple of
+# conditions) and each one is read off its own index range and limited on its own, then only the few rows they
+# give back are merged and sorted
+def keyset_paginate(select, timestamp_column, id_column, cursor=None, per_page=6, branches=None):
+    decoded = decode_cursor(cursor)
+    bound = ()
+    if decoded is None:
+        direction = 'next'
+        order_by = (timestamp_column.desc(), id_column.desc())
+    else:
+        direction, timestamp, id = decoded
+        # a row value comparison rather than ts < x OR (ts = x AND id < y) - sqlite (and postgres) can turn
+        # it into a range on a (timestamp, id) index, where the OR form walks the index from the top every time
+        if direction == 'next':
+            # older than the last item on the previous page
+            bound = (sa.tuple_(timestamp_column, id_column) < (timestamp, id),)
+            order_by = (timestamp_column.desc(), id_column.desc())
+        else:
+            # newer than the first item on the next page - walk backwards then flip back to newest first
+            bound = (sa.tuple_(timestamp_column, id_column) > (timestamp, id),)
+            order_by = (timestamp_column.asc(), id_column.asc())
+
+    if branches is None:
+        select = select.where(*bound).order_by(*order_by)
+    else:
+        ids = sa.union_all(*[
+            sa.select(sa.select(id_column).where(*conditions, *bound).order_by(*order_by).limit(per_page + 1).subquery())
+            for conditions in branches
+        ])
+        select = select.where(id_column.in_(ids)).order_by(*order_by)
+
+    # grab one extra row to find out if there is another page without counting
+    items = db.session.scalars(select.limit(per_page + 1)).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+
+    if direction == 'next':
+        has_next = has_more
+        has_prev = decoded is not None
+    else:
+        items.reverse()
+        has_next = True
+        has_prev = has_more
+
+    def cursor_for(direction, item):
+        return encode_cursor(direction, getattr(item, timestamp_column.key), getattr(item, id_column.key))
+
+    next_cursor = cursor_for('next', items[-1]) if items and has_next else None
+    prev_cursor = cursor_for('prev', items[0]) if items and has_prev else None
+    return KeysetPage(items, bool(next_cursor), bool(prev_cursor), next_cursor, prev_cursor)
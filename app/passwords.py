@@ -0,0 +1,91 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import lru_cache
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+from app.metrics import registry, metrics_enabled
+
+# password hashing is slow on purpose, so it runs on a small pool of its own instead of on the request thread
+# - a burst of logins can only ever use PASSWORD_HASH_WORKERS threads (default 2) worth of cpu
+# - at most PASSWORD_HASH_QUEUE more (default 8) wait their turn, anything past that is turned away straight away
+#   with PasswordHashingBusy instead of tying up a request thread
+# - a caller gives up after PASSWORD_HASH_TIMEOUT seconds (default 10)
+# PASSWORD_HASH_METHOD sets the hash (any werkzeug method string, default 'scrypt') - hashes made with
+# different settings still check fine and get redone on the user's next login (see login in routes.py)
+# scrypt and pbkdf2 both release the GIL so the pool really does run them next to the request threads
+
+
+class PasswordHashingBusy(Exception):
+    pass
+
+
+_lock = threading.Lock()
+
+
+# (executor, slots) for the current app - each app gets a pool sized by its own config
+def _get_pool():
+    app = current_app._get_current_object()
+    pool = app.extensions.get('password_hashing')
+    if pool is None:
+        with _lock:
+            pool = app.extensions.get('password_hashing')
+            if pool is None:
+                workers = app.config.get('PASSWORD_HASH_WORKERS', 2)
+                slots = threading.BoundedSemaphore(workers + app.config.get('PASSWORD_HASH_QUEUE', 8))
+                executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+                pool = app.extensions['password_hashing'] = (executor, slots)
+    return pool
+
+
+def hash_method():
+    return current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt')
+
+
+# runs fn(*args) on the hashing pool and waits for the answer
+def _run(operation, fn, *args):
+    executor, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        if metrics_enabled():
+            registry.inc('password_hashes_rejected_total', (('operation', operation),))
+        raise PasswordHashingBusy()
+    started = time.perf_counter()
+    try:
+        future = executor.submit(fn, *args)
+    except BaseException:
+        slots.release()
+        raise
+    # the slot is only free once the work is really done, even if the caller has stopped waiting
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        result = future.result(timeout=current_app.config.get('PASSWORD_HASH_TIMEOUT', 10))
+    except TimeoutError:
+        raise PasswordHashingBusy()
+    if metrics_enabled():
+        # includes the time spent queued, which is what the user waits for
+        registry.observe('password_hash_duration_seconds', (('operation', operation),), time.perf_counter() - started)
+    return result
+
+
+def hash_password(password):
+    return _run('hash', generate_password_hash, password, hash_method())
+
+
+def verify_password(password_hash, password):
+    if not password_hash:
+        return False
+    return _run('check', check_password_hash, password_hash, password)
+
+
+# the settings part of a hash made with method (ie 'scrypt' -> 'scrypt:32768:8:1'), worked out once per method
+# by hashing an empty password so werkzeug's own defaults are what we compare against
+@lru_cache(maxsize=8)
+def _method_settings(method):
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+# True when password_hash was made with different settings than PASSWORD_HASH_METHOD asks for now
+def needs_rehash(password_hash):
+    if not password_hash:
+        return False
+    return password_hash.split('$', 1)[0] != _method_settings(hash_method())
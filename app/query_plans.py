@@ -0,0 +1,152 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+from app.models import User, Message, PuzzleSearchTerm
+from app.bench import feed_cursor
+from app.threads import thread_page
+from app.cache import feed_cache
+from app.fragments import fragment_cache
+
+# EXPLAIN QUERY PLAN for every query the busiest pages run (run with `flask indexes check`)
+#
+# the pages are fetched through the test client as a real user with messages and every statement they send is
+# captured, so it is the queries the app really runs that get checked rather than copies of them
+# a query that reads a whole message or puzzle table, walks a whole index of one or sorts more of one than it
+# returns (an index was dropped, or a query was changed so it can't use one any more) is reported - sqlite only, the database the app is developed against
+
+# tables that grow with use - a full scan of anything else (category, ...) is fine
+LARGE_TABLES = ('message', 'puzzle', 'puzzle_search_term', 'conversation')
+
+# 'SCAN message' / 'SCAN TABLE message AS m' with no index after it (older sqlite versions say TABLE)
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+# 'SCAN message USING INDEX ix_message_thread' - the whole index walked in order, with no (column=? ...) bound on it
+INDEX_WALK = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)? USING (?:COVERING )?INDEX \w+$')
+# any read of a table (a SEARCH by rowid is one row at a time from a list, not a range of them)
+TABLE_READ = re.compile(r'^(?:SCAN|SEARCH) (?:TABLE )?(\w+)')
+ROWID_LOOKUP = 'USING INTEGER PRIMARY KEY'
+TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+LIMIT = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+
+# pages whose first query reads the newest rows off the top of an index - walking it until the LIMIT is how they
+# get one page, where a page further in (or any other page) walking an index means its WHERE can't bound it
+FROM_THE_TOP = ('index',)
+
+
+# the user with the most messages, so every page has something to show
+def busiest_user():
+    return db.session.scalar(
+        sa.select(User)
+        .join(Message, Message.recipient_owner_id == User.id)
+        .group_by(User.id)
+        .order_by(sa.func.count(Message.id).desc())
+        .limit(1))
+
+
+# urls of the pages to check as user
+def hot_pages(user):
+    partner = db.session.execute(
+        sa.select(Message.sender_requester_id, Message.puzzle_id)
+        .where(Message.recipient_owner_id == user.id)
+        .order_by(Message.timestamp.desc())
+        .limit(1)).first()
+    term = db.session.scalar(sa.select(PuzzleSearchTerm.term).limit(1))
+    pages = {'index': '/index', 'messages': '/messages', 'user': f'/user/{user.username}'}
+    cursor = feed_cursor(user, 2)
+    if cursor:
+        pages['index_next_page'] = f'/index?cursor={cursor}'
+    if term:
+        pages['index_search'] = f'/index?query={term}'
+    if partner:
+        pages['messages_thread'] = f'/messages?recipient_id={partner.sender_requester_id}&puzzle_id={partner.puzzle_id}'
+        older_cursor = thread_page(user.id, partner.sender_requester_id, partner.puzzle_id).next_cursor
+        if older_cursor:
+            pages['messages_older'] = (f'/messages/older?recipient_id={partner.sender_requester_id}'
+                                       f'&puzzle_id={partner.puzzle_id}&before={older_cursor}')
+    return pages
+
+
+# the lines of plan (EXPLAIN QUERY PLAN rows of (id, parent, notused, detail)) that read a large table badly
+# - a full scan, an index walked with no bound (unless page reads from the top and stops at a LIMIT), or a temp sort
+# of large table rows to hand back only a LIMIT of them (sorting all the rows a statement returns anyway is fine)
+def plan_problems(page, statement, plan):
+    limited = bool(LIMIT.search(statement))
+    children = {}
+    for id, parent, _, detail in plan:
+        children.setdefault(parent, []).append((id, detail))
+
+    # what a sort at one level of the plan orders - the tables read at that level, through a MULTI-INDEX OR too
+    def reads(parent):
+        for id, detail in children.get(parent, []):
+            if detail == 'MULTI-INDEX OR':
+                for index_id, _ in children.get(id, []):
+                    yield from (detail for _, detail in children.get(index_id, []))
+            else:
+                yield detail
+
+    problems = []
+    for id, parent, _, detail in plan:
+        if (match := FULL_SCAN.match(detail)) and match.group(1) in LARGE_TABLES:
+            problems.append(detail)
+        elif (match := INDEX_WALK.match(detail)) and match.group(1) in LARGE_TABLES:
+            if not (page in FROM_THE_TOP and limited):
+                problems.append(detail)
+        elif detail == TEMP_SORT and limited:
+            if any((match := TABLE_READ.match(read)) and match.group(1) in LARGE_TABLES and ROWID_LOOKUP not in read
+                   for read in reads(parent)):
+                problems.append(detail)
+    return problems
+
+
+# returns (pages checked, {page name: [(statement, [plan line, ...]), ...]}) - only statements plan_problems finds
+# something wrong with are listed
+def check_query_plans(user=None):
+    if db.engine.dialect.name != 'sqlite':
+        raise ValueError('query plans can only be checked on sqlite')
+    user = user or busiest_user()
+    if user is None:
+        raise ValueError('no users with messages to check the pages as')
+    pages = hot_pages(user)
+    user_id = user.id
+    app = current_app._get_current_object()
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    def fetch_pages():
+        statements = {}
+        with app.test_client() as client:
+            with client.session_transaction() as session:
+                session['_user_id'] = str(user_id)
+                session['_fresh'] = True
+            for name, url in pages.items():
+                # a cached page runs no queries at all
+                feed_cache.clear()
+                fragment_cache.clear()
+                captured.clear()
+                response = client.get(url)
+                if response.status_code >= 400:
+                    raise RuntimeError(f'GET {url} returned {response.status_code}')
+                statements[name] = list(captured)
+        return statements
+
+    sa.event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        # a thread of its own gets each request a fresh app context (see bench.run)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            statements = executor.submit(fetch_pages).result()
+    finally:
+        sa.event.remove(db.engine, 'before_cursor_execute', capture)
+
+    problems = {}
+    with db.engine.connect() as connection:
+        for name, executed in statements.items():
+            for statement, parameters in executed:
+                if not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                    continue
+                plan = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+                if plan_problems(name, statement, plan):
+                    problems.setdefault(name, []).append((statement, [row[-1] for row in plan]))
+    return pages, problems
@@ -0,0 +1,99 @@
+import random
+import sqlite3
+import time
+from contextlib import closing
+import sqlalchemy as sa
+from flask import Blueprint, current_app, g, has_request_context, request, session as user_session
+from flask_sqlalchemy.session import Session
+
+# sends the queries of read-only requests to read replicas so they don't compete with writes on the primary
+#
+# - SQLALCHEMY_REPLICA_URIS in app config lists the replica databases (empty = everything uses the primary)
+# - GET/HEAD requests read from one replica picked at random for the whole request
+# - everything else uses the primary, and so does a GET as soon as it writes anything
+# - after a write the user's next requests read from the primary for REPLICA_STICKY_SECONDS (default 10) so
+#   they see their own changes even if the replicas are behind
+# - work done outside a request (cli, image workers, last seen flushes) always uses the primary
+# for trying it out locally, point a replica at a copy of the sqlite file and refresh the copy with `flask replicas sync`
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+# makes an engine for each configured replica and keeps them on the app - create_app() calls this
+# they're plain engines rather than flask-sqlalchemy binds: a bind would add its metadata to the db object every
+# app shares, and db.create_all() on an app without replicas would then look for a bind it doesn't have
+def init_app(app):
+    options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+    app.extensions['replica_engines'] = [
+        sa.create_engine(uri, **options) for uri in app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+    ]
+
+
+def replica_engines():
+    return current_app.extensions.get('replica_engines') or []
+
+
+# only plain SELECTs can go to a replica - inserts/updates/deletes, SELECT ... FOR UPDATE and raw text() stay on the primary
+def is_read(clause):
+    return clause is not None and getattr(clause, 'is_select', False) and getattr(clause, '_for_update_arg', None) is None
+
+
+# db.session uses this (see session_options in app/__init__.py)
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or not has_request_context() or engine is not self._db.engines.get(None):
+            return engine
+        if self._flushing or not is_read(clause):
+            # reads for the rest of this request (and the next few) need to see this write
+            g.wrote_to_primary = True
+            return engine
+        if g.get('read_from_replica') and not g.get('wrote_to_primary'):
+            replica = g.get('replica_engine')
+            if replica is None:
+                replicas = replica_engines()
+                if not replicas:
+                    return engine
+                replica = g.replica_engine = random.choice(replicas)
+            return replica
+        return engine
+
+
+bp = Blueprint('replicas', __name__)
+
+
+def replicas_configured():
+    return bool(replica_engines())
+
+
+@bp.before_app_request
+def choose_database():
+    g.read_from_replica = (
+        replicas_configured()
+        and request.method in SAFE_METHODS
+        and user_session.get('_primary_until', 0) < time.time()
+    )
+
+
+@bp.after_app_request
+def stick_to_primary(response):
+    if replicas_configured() and (request.method not in SAFE_METHODS or g.get('wrote_to_primary')):
+        user_session['_primary_until'] = time.time() + current_app.config.get('REPLICA_STICKY_SECONDS', 10)
+    return response
+
+
+# copies the primary sqlite database over each sqlite replica (local testing only - real replicas replicate themselves)
+# returns the paths written
+def sync_sqlite_replicas(primary_engine, uris):
+    if primary_engine.dialect.name != 'sqlite':
+        raise ValueError('replicas can only be synced from a sqlite primary')
+    written = []
+    for uri in uris:
+        url = sa.engine.make_url(uri)
+        if url.get_backend_name() != 'sqlite' or not url.database:
+            raise ValueError(f'{uri} is not a sqlite file')
+        # the backup api copies a consistent snapshot even while the app is writing
+        with closing(sqlite3.connect(primary_engine.url.database)) as source, closing(sqlite3.connect(url.database)) as target:
+            source.backup(target)
+        written.append(url.database)
+    return written
@@ -1,52 +1,72 @@
-from app import app, db
-from flask import render_template, flash, redirect, url_for, request, send_from_directory, jsonify
+from app import db
+from flask import Blueprint, current_app, render_template, flash, redirect, url_for, request, jsonify, Response
 from app.forms import LoginForm, RegistrationForm, CreatePuzzleForm
-from app.models import User, Puzzle, Category, Message
+from app.models import User, Puzzle, Category, Message, Conversation
 from flask_login import current_user, login_user, logout_user, login_required
 from urllib.parse import urlsplit 
 import sqlalchemy as sa
-from sqlalchemy import or_, and_, func
 from datetime import datetime, timezone
 from flask_wtf.file import FileRequired
-from config import Config
-
+from app.search import search_puzzles, index_puzzle, unindex_puzzle, tokenize
+from app.pagination import keyset_paginate, decode_cursor
+from app.threads import thread_page
+from app.loaders import with_puzzle_cards
+from app.last_seen import current_tracker as last_seen_tracker
+from app.images import queue_variants
+from app.uploads import save_upload, send_upload
+from app.avatars import send_avatar
+from app.events import event_stream, publish_new_message, publish_unread_count
+from app.cache import cached_page, bump_catalog_version
+from app.sql_budget import query_budget
+from app.metrics import metrics_response
+from app.passwords import PasswordHashingBusy
+
+# every page of the site (endpoint names are 'main.<view>', ie url_for('main.index'))
+bp = Blueprint('main', __name__)
 
 
 # controls what viewer will see (view functions!)
 # two decorators creates association between url given as argument
 # and the function (when web browser requests either of these two urls, Flask will invoke this function and pass return value to browser as response)
 # HOME
-@app.route('/')
-@app.route('/index')
+@bp.route('/')
+@bp.route('/index')
 @login_required
+@query_budget(8)
 def index():
     # include search functionality -server side 
     query = request.args.get('query', '')
     # try pagination
+    # search results are ranked so they page by number, the feed pages by cursor (see app/pagination.py)
     page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 6
-    if query:
-        results = Puzzle.query.join(Puzzle.categories).filter( 
-            or_(
-            Puzzle.title.ilike(f'%{query}%'),
-            Puzzle.pieces.ilike(f'%{query}%'),
-            Puzzle.manufacturer.ilike(f'%{query}%'),
-            Puzzle.condition.ilike(f'%{query}%'),
-            Puzzle.description.ilike(f'%{query}%'),
-            Category.name.ilike(f'%{query}%')
-        ),
-        Puzzle.user_id != current_user.id,
-        Puzzle.is_deleted == False
-    ).distinct().paginate(page=page, per_page=per_page, error_out=False)
+    # _puzzle.html shows each puzzle's author and categories - load them with the page so cached
+    # pages carry them too and rendering a cached page needs no queries (see app/loaders.py)
+    # search goes through the puzzle_search_term index (see app/search.py) instead of ilike-ing every column
+    search = search_puzzles(query)
+    if search is not None:
+        def load_results():
+            return db.paginate(with_puzzle_cards(search.where(
+                Puzzle.user_id != current_user.id,
+                Puzzle.is_deleted == False
+            )), page=page, per_page=per_page, error_out=False)
+        # same words in any case/punctuation is the same search
+        cache_key = ('search', ' '.join(tokenize(query)), page, current_user.id)
     else:
-        results = db.session.query(Puzzle).filter(Puzzle.is_available==True, Puzzle.user_id!=current_user.id).order_by(Puzzle.timestamp.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        def load_results():
+            feed = with_puzzle_cards(sa.select(Puzzle).where(Puzzle.is_available==True, Puzzle.user_id!=current_user.id))
+            return keyset_paginate(feed, Puzzle.timestamp, Puzzle.id, cursor=cursor, per_page=per_page)
+        cache_key = ('feed', cursor, current_user.id)
+    # pages are cached until the catalog changes (see app/cache.py)
+    results = cached_page(cache_key, load_results)
 
     # rendertemplate() function included with Flask that uses Jinja template engine takes template filename
     # and returns html with placeholders replaced with values
     return render_template('index.html', title='Home', puzzles_pagination=results, query=query, user=user, show_buttons=False, small_card_size=True)
 
 # SEARCH
-# @app.route('/search', methods=['GET'])
+# @bp.route('/search', methods=['GET'])
 # def search():
 #     # try:
 #     # retrieve query parameter
@@ -82,11 +102,11 @@ def index():
 
 # LOGIN
 # will now accept get and post requests to server
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     # if user already logged in, go to homepage
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     form = LoginForm()
     """
     will process the input of form based on what request is sent
@@ -99,10 +119,19 @@ def login():
         user = db.session.scalar(
             sa.select(User).where(User.username == form.username.data))
         # if never signed in before or password hash does not match generated pwd hash (previously, if logged in before), show user msg
-        if user is None or not user.check_password(form.password.data):
+        try:
+            password_ok = user is not None and user.check_password(form.password.data)
+            # hashes made with older settings get redone while we have the password
+            if password_ok and user.password_needs_rehash():
+                user.set_password(form.password.data)
+                db.session.commit()
+        except PasswordHashingBusy:
+            flash('Lots of people are signing in right now, please try again in a moment')
+            return render_template('login.html', title='Sign In', form=form), 503
+        if not password_ok:
             flash('Invalid username or password')
             # shows login page again 
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         # otherwise, log the user in and remember them
         # this will remember their unique id when visiting any pages while logged in
         login_user(user, remember=form.remember_me.data)
@@ -113,36 +142,41 @@ def login():
         # if has_value returns None OR if it's a relative url (ie no domain )
         if not has_value or urlsplit(has_value).netloc != '':
             # give value of 'next' in query string, the value of index
-            has_value = url_for('index')
+            has_value = url_for('main.index')
         # direct user to homepage
         return redirect(has_value)
     return render_template('login.html', title='Sign In', form=form)
 
 # LOGOUT
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 # REGISTER
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     form = RegistrationForm()
     if form.validate_on_submit():
         user = User(username = form.username.data, email=form.email.data)
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except PasswordHashingBusy:
+            flash('Lots of people are signing up right now, please try again in a moment')
+            return render_template('register.html', title='Register', form=form), 503
         db.session.add(user)
         db.session.commit()
         flash('Success! Happy Puzzling!')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('register.html', title='Register', form=form)
 
 # PROFILE
 # < > makes it populate dynamically based on who is logged in 
-@app.route('/user/<username>')
+@bp.route('/user/<username>')
 @login_required
+@query_budget(8)
 def user(username):
     # will get matching username from db and if no match will send 404 error to user (not found)
     user = db.first_or_404(sa.select(User).where(User.username == username))
@@ -150,7 +184,10 @@ def user(username):
     requested_count = 0
     progress_count = 0
     
-    puzzles_current_user = db.session.query(Puzzle).filter_by(user_id=current_user.id, is_deleted=False).all()
+    # every card on the page is one of these, so their authors and categories come with them (see app/loaders.py)
+    puzzles_current_user = db.session.scalars(with_puzzle_cards(
+        sa.select(Puzzle).where(Puzzle.user_id == current_user.id, Puzzle.is_deleted == False)
+    )).all()
     
     available_puzzles = []
     in_progress_puzzles = []
@@ -166,18 +203,23 @@ def user(username):
         elif puzzle.is_requested:
             requested_count += 1
             requested_puzzles.append(puzzle)
-    return render_template('user.html', puzzles=puzzles_current_user, available_puzzles=available_puzzles, in_progress_puzzles=in_progress_puzzles, requested_puzzles=requested_puzzles, user=user, sharing_count=sharing_count, progress_count=progress_count, requested_count=requested_count, show_buttons=True)
+    # the tracker may have a newer time than the db if it hasn't flushed yet
+    last_seen = last_seen_tracker().seen_at(user.id) or user.last_seen
+    return render_template('user.html', last_seen=last_seen, puzzles=puzzles_current_user, available_puzzles=available_puzzles, in_progress_puzzles=in_progress_puzzles, requested_puzzles=requested_puzzles, user=user, sharing_count=sharing_count, progress_count=progress_count, requested_count=requested_count, show_buttons=True)
 
 # executed before any of the view functions are executed
 # checks if the current user is logged in and lets you set last seen as that time 
-@app.before_request
+# times are buffered and written in batches by the tracker (see app/last_seen.py) rather than a commit per request
+@bp.before_app_request
 def before_request():
+    # image fetches and metric scrapes don't count as the user being around
+    if request.endpoint in ('main.get_file', 'main.avatar', 'static', 'main.metrics'):
+        return
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.now(timezone.utc)
-        db.session.commit()
+        last_seen_tracker().touch(current_user.id)
 
 #EDIT PROFILE
-@app.route('/edit_profile', methods=['GET', 'POST'])
+@bp.route('/edit_profile', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
     # form = EditProfileForm()
@@ -193,25 +235,41 @@ def edit_profile():
             # return True or False
             if user:
                  flash('Username already taken')
-                 return redirect(url_for('user', username=current_user.username))
+                 return redirect(url_for('main.user', username=current_user.username))
        
+        username_changed = username != current_user.username
         current_user.username = username
         current_user.about_me = about_me
         db.session.commit()
+        # cached feed pages hold their puzzles' authors as they were loaded
+        if username_changed:
+            bump_catalog_version()
         flash('Profile updated successfully')
-        return redirect(url_for('user', username=current_user.username))
-        # return redirect(url_for('user', username=current_user.username))
+        return redirect(url_for('main.user', username=current_user.username))
+        # return redirect(url_for('main.user', username=current_user.username))
                
 
 # get image url 
-@app.route('/uploads/<filename>')
+# uploads are named by content hash so they're served with long-lived caching headers (see app/uploads.py)
+@bp.route('/uploads/<filename>')
 def get_file(filename):
-    return send_from_directory(Config.UPLOADED_PHOTOS_DEST, filename)
+    return send_upload(filename)
+
+# request metrics for prometheus to scrape (see app/metrics.py)
+@bp.route('/metrics')
+def metrics():
+    return metrics_response()
+
+
+# user avatars (identicon made from the username digest)
+@bp.route('/avatar/<digest>/<int:size>')
+def avatar(digest, size):
+    return send_avatar(digest, size)
 
 # edit
-@app.route('/save_puzzle/<int:puzzle_id>', methods=['GET','POST'])
+@bp.route('/save_puzzle/<int:puzzle_id>', methods=['GET','POST'])
 # create
-@app.route('/save_puzzle', methods=['GET', 'POST'])
+@bp.route('/save_puzzle', methods=['GET', 'POST'])
 @login_required
 
 # default puzzle_id is None
@@ -259,19 +317,27 @@ def save_puzzle(puzzle_id=None):
                     form.categories.errors.append('Please select at leasat one category')
                     return redirect(url_for('/save_puzzle', puzzle_id=form.puzzle_id.data))
                 # get all the categories based on id of specific input from user and loop through 
-                puzzle.categories = [Category.query.get(category_id) for category_id in form.categories.data]
+                # picked from the categories already loaded for the form instead of a get() per id
+                puzzle.categories = [category for category in categories if category.id in form.categories.data]
+                saved_image = None
                 if form.image.data:
                     uploaded_image = form.image.data
-                    saved_image = Config.photos.save(uploaded_image)
-                    file_url = url_for('get_file', filename=saved_image)
+                    saved_image = save_upload(uploaded_image)
+                    file_url = url_for('main.get_file', filename=saved_image)
                     puzzle.image_url = file_url
+                    # old variants belong to the old image
+                    puzzle.image_variants = None
                 else:
                     
                     puzzle.image_url = form.existing_image_url.data
 
-
+                index_puzzle(puzzle)
                 db.session.commit()
-                return redirect(url_for('user', username=current_user.username)) 
+                bump_catalog_version()
+                # resize in the background once the puzzle is saved
+                if saved_image:
+                    queue_variants(puzzle.id, saved_image, puzzle.image_url)
+                return redirect(url_for('main.user', username=current_user.username)) 
     # creating puzzle 
     else:
                
@@ -294,22 +360,28 @@ def save_puzzle(puzzle_id=None):
                     form.categories.errors.append('Please select at leasat one category')
                     return render_template('create_puzzle.html', title='Save Puzzle', form=form)
             # get all the categories based on id of specific input from user and loop through 
-            puzzle.categories = [Category.query.get(category_id) for category_id in form.categories.data]
+            puzzle.categories = [category for category in categories if category.id in form.categories.data]
 
+            saved_image = None
             if form.image.data:
                 uploaded_image = form.image.data
-                saved_image = Config.photos.save(uploaded_image)
-                file_url = url_for('get_file', filename=saved_image)
+                saved_image = save_upload(uploaded_image)
+                file_url = url_for('main.get_file', filename=saved_image)
                 puzzle.image_url = file_url
             
             db.session.add(puzzle)
+            index_puzzle(puzzle)
             db.session.commit()
-            return redirect(url_for('user', username=current_user.username))
+            bump_catalog_version()
+            # resize in the background once the puzzle is saved
+            if saved_image:
+                queue_variants(puzzle.id, saved_image, puzzle.image_url)
+            return redirect(url_for('main.user', username=current_user.username))
      
     return render_template('create_puzzle.html', title='Save Puzzle', form=form, choices=form.condition.choices, existing_image_url = form.existing_image_url.data)
 
 # SOFT DELETE PUZZLE
-@app.route('/puzzle/delete', methods=['GET', 'POST'])
+@bp.route('/puzzle/delete', methods=['GET', 'POST'])
 @login_required
 def delete_puzzle():
     # delete_type = request.form.get('delete-type')
@@ -319,18 +391,20 @@ def delete_puzzle():
         puzzle_by_id = db.session.query(Puzzle).filter_by(id=item_id).first()
     except Exception as e:
         flash("Something went wrong")
-        return redirect(url_for('user', username=current_user.username))
+        return redirect(url_for('main.user', username=current_user.username))
     else:
         if puzzle_by_id and puzzle_by_id.user_id == current_user.id:
             # 'delete' - change is_deleted to True and do not show on page through filtering
             puzzle_by_id.is_deleted = True
             puzzle_by_id.is_available = False
+            unindex_puzzle(puzzle_by_id)
             db.session.commit()
+            bump_catalog_version()
             flash("Your delete was successful. The puzzle is no longer in circulation.")
-    return redirect(url_for('user', username=current_user.username))
+    return redirect(url_for('main.user', username=current_user.username))
 
 # CONFIRM DELETE    
-@app.route('/confirm_delete', methods=['GET'])
+@bp.route('/confirm_delete', methods=['GET'])
 @login_required
 
 
@@ -344,11 +418,11 @@ def confirm_delete():
         item = db.session.query(Message).filter_by(id=item_id).first()
     else:
         flash('Not valid delete type')
-        return redirect(url_for('user', username=current_user.username))
+        return redirect(url_for('main.user', username=current_user.username))
     # return render_template('confirm_delete.html', delete_type=delete_type, item=item)
 
 # SEND MESSAGE
-@app.route('/send_message', methods=['GET', 'POST'])
+@bp.route('/send_message', methods=['GET', 'POST'])
 @login_required
 def send_message():
     recipient_id = request.form['recipient_id']
@@ -360,15 +434,17 @@ def send_message():
         # content = request.form.get('content')
         # if not content:
         #     flash('Message content cannot be empty.')
-        #     return redirect(url_for('messages', user_id=user.id, puzzle_id=puzzle.id))
+        #     return redirect(url_for('main.messages', user_id=user.id, puzzle_id=puzzle.id))
         # edit these fields to signify puzzle is being requested- should no longer show up on homepage
         # would need to edit the puzzle's is_requested value - change to true and change all other boolean values to false
         
         puzzle = db.session.query(Puzzle).filter_by(id=puzzle_id).first()
-        if current_user.id != puzzle.user_id and not puzzle.in_progress:
+        # saved in the same commit as the message - committing here would make everything below reload
+        # current_user and the recipient
+        requested = current_user.id != puzzle.user_id and not puzzle.in_progress
+        if requested:
             puzzle.is_available = False
             puzzle.is_requested = True
-            db.session.commit()
 
         msg = Message(
             author=current_user,
@@ -384,24 +460,31 @@ def send_message():
             is_automated=False
         )
         db.session.add(msg)
+        Conversation.record_message(msg)
+        User.adjust_unread_count(user.id, 1)
         db.session.commit()
+        if requested:
+            bump_catalog_version()
+        publish_new_message(msg, user)
         flash('Your message has been sent!')
-        return redirect(url_for('messages', recipient_id=recipient_id, puzzle_id=puzzle_id ))
-    return redirect(url_for('messages', recipient_id=recipient_id, puzzle_id=puzzle_id))
+        return redirect(url_for('main.messages', recipient_id=recipient_id, puzzle_id=puzzle_id ))
+    return redirect(url_for('main.messages', recipient_id=recipient_id, puzzle_id=puzzle_id))
 
-@app.route('/request_puzzle/<int:puzzle_id>', methods=['GET', 'POST'])
+@bp.route('/request_puzzle/<int:puzzle_id>', methods=['GET', 'POST'])
 @login_required
 def request_puzzle(puzzle_id):
     puzzle = Puzzle.query.get_or_404(puzzle_id)
     puzzle.is_requested = True
     db.session.commit()
-    return redirect(url_for('messages', recipient_id=puzzle.author.id, puzzle_id = puzzle_id))
+    bump_catalog_version()
+    return redirect(url_for('main.messages', recipient_id=puzzle.author.id, puzzle_id = puzzle_id))
 
 # show list of user conversations
 # show conversations
 # send messages using form
-@app.route('/messages')
+@bp.route('/messages')
 @login_required 
+@query_budget(12)
 def messages():
 
     # whoever is getting the request for the puzzle 
@@ -412,7 +495,8 @@ def messages():
     
     is_puzzle_in_progress = False
     is_puzzle_requested = False
-    puzzle = Puzzle.query.get(puzzle_id)
+    # no puzzle_id means no thread is open - Puzzle.query.get(None) would still read the whole puzzle table
+    puzzle = db.session.get(Puzzle, puzzle_id) if puzzle_id else None
     if puzzle:
         if puzzle.in_progress:
             is_puzzle_in_progress = True
@@ -422,114 +506,66 @@ def messages():
    
  
 
-    # get all the users that have sent current_user messages (populate the list of users on page)
-   
-    # also want to show users that the current user has sent messages to but they have not replied back yet... 
-    # need to get the count of unread messages sent from other users to the recipient (current_user)
-    message_senders = db.session.query(
-        User,
-        User.id,
-        
-        # get count of messages where...
-        # the current user has not read it and make sure the recipient is the current_user
-        func.count(
-                Message.id
-        ).filter(
-            and_(
-
-                Message.is_read == False,
-                Message.recipient_owner_id == current_user.id
-            )
-
-        ).label('unread_count')    
-        # join the Message and User table to get all the users who sent or received messages
-    ).join(
-        Message,
-        or_(
-            Message.sender_requester_id == User.id,
-            Message.recipient_owner_id == User.id
-        )
-    ).filter(
-        # filter through the messages to get messages where the current user either sent or received messages 
-        or_(
-            Message.recipient_owner_id == current_user.id,
-            Message.sender_requester_id == current_user.id
-        )
-    ).group_by(User.id).all()
-
-    def get_puzzles(sender_id, recipient_id):
-        # query puzzles and join with messages table to get puzzles that matches what puzzle_id the message is referring to
-        puzzles = db.session.query(Puzzle).join(
-            Message,
-            Puzzle.id == Message.puzzle_id
-        # filter sender id of message is sender id and recipient is the recipient id OR sender is the recipient id and recipient is sender id  
-        ).filter(
-            or_(
-                and_(Message.sender_requester_id == sender_id, Message.recipient_owner_id == recipient_id),
-                and_(Message.sender_requester_id == recipient_id, Message.recipient_owner_id == sender_id)
-            ),
-        # filter out all the puzzles where the recipient or sender if the current user and the messages have been deleted by the current user 
-            or_(
-                and_(Message.recipient_owner_id == current_user.id, Message.is_deleted_by_recipient == False),
-                and_(Message.sender_requester_id == current_user.id, Message.is_deleted_by_sender == False)
-            )  
-            # ensures only unique puzzle ids are returned    
-        ).group_by(Puzzle.id).all()
-        return puzzles
-
-    
-    senders_with_puzzle = []
-    # sender = tuple
-    for sender in message_senders:
-        # returns list of puzzle objects- pass in sender id and current_user id is the recipient id
-        puzzles = get_puzzles(sender.id, current_user.id)
-        
-        # get actual sender(user) object so can have access to all the functions in specific user object
-        sender_object = User.query.get(sender.id)
-        senders_with_puzzle.append({
-            'sender': sender_object, 
-            'puzzles': puzzles, 
-            'unread_count': sender.unread_count
-        })
+    # get all the users that current_user has a conversation with (populate the list of users on page)
+    # along with the puzzles they've talked about and the count of unread messages from each of them
+    # loaded in a fixed number of queries however many people the user trades with (see User.conversation_partners)
+    senders_with_puzzle = current_user.conversation_partners()
     
     recipient = None
     messages_between_sender_recipient = []
+    older_cursor = None
+    last_message_id = None
     # check to see if there is a conversation between the two users 
     if recipient_id:
         recipient = User.query.get(recipient_id)
-        messages_between_sender_recipient = db.session.query(Message).filter(
-
-                and_(
-                ((Message.is_deleted_by_sender == False) & (Message.sender_requester_id == current_user.id)) |
-                ((Message.recipient_owner_id == current_user.id) & (Message.is_deleted_by_recipient == False)),
-
-                ((Message.recipient_owner_id == current_user.id)) & ((Message.sender_requester_id == recipient.id)) |
-                ((Message.recipient_owner_id == recipient.id)) & ((Message.sender_requester_id == current_user.id)),
-                
-                (Message.puzzle_id == puzzle_id)
-            )
-            ).order_by(Message.timestamp.asc()).all()
-        
-    # somehow need to find a way to get approve/decline to appear on last message of the related puzzle 
-    # dictionary store last message Id 
-    last_message_ids = {}
-
-    for message in messages_between_sender_recipient:
-        last_message_ids[message.puzzle_id] = message.id
+        # one primary key lookup on the conversation says whether there's anything to show before reading messages
+        conversation = Conversation.between(current_user.id, recipient.id, puzzle_id) if recipient and puzzle_id else None
+        if conversation and not conversation.is_deleted_by(current_user.id):
+            # only the newest messages - older ones are fetched from older_messages as the user scrolls up
+            page = thread_page(current_user.id, recipient.id, puzzle_id)
+            messages_between_sender_recipient = page.items
+            older_cursor = page.next_cursor
+            # approve/decline go on the last message of the thread, which the conversation row already knows
+            last_message_id = conversation.last_message_id
     
     
-    return render_template('messages.html', recipient=recipient, is_puzzle_in_progress=is_puzzle_in_progress, is_puzzle_requested=is_puzzle_requested, message_senders=senders_with_puzzle, conversation=messages_between_sender_recipient, puzzle_id=puzzle_id, last_message_ids=last_message_ids)
+    return render_template('messages.html', recipient=recipient, is_puzzle_in_progress=is_puzzle_in_progress, is_puzzle_requested=is_puzzle_requested, message_senders=senders_with_puzzle, conversation=messages_between_sender_recipient, puzzle_id=puzzle_id, last_message_id=last_message_id, older_cursor=older_cursor, live_updates=True)
+
+
+# older messages of a thread for messages.html to put above the ones on screen as the user scrolls up
+# ?recipient_id=4&puzzle_id=5&before=<older_cursor> - answers with the rendered messages and the cursor for the next lot
+@bp.route('/messages/older')
+@login_required
+@query_budget(8)
+def older_messages():
+    recipient_id = request.args.get('recipient_id', type=int)
+    puzzle_id = request.args.get('puzzle_id', type=int)
+    cursor = request.args.get('before')
+    if not recipient_id or not puzzle_id or decode_cursor(cursor) is None:
+        return jsonify({'status': 'failure'}), 400
+    recipient = db.get_or_404(User, recipient_id)
+    page = thread_page(current_user.id, recipient.id, puzzle_id, cursor=cursor)
+    # the last message (and its approve/decline buttons) is always on the first page, never an older one
+    html = render_template('_thread.html', conversation=page.items, recipient=recipient, puzzle_id=puzzle_id,
+                           last_message_id=None)
+    return jsonify({'status': 'success', 'html': html, 'older_cursor': page.next_cursor})
 
 
 # mark individual messages as read
-@app.route('/message/read/<int:message_id>', methods=['POST'])
+@bp.route('/message/read/<int:message_id>', methods=['POST'])
 @login_required
+@query_budget(8)
 def mark_message_as_read(message_id):
     # get individual message by message_id
     message = db.session.query(Message).filter_by(id=message_id, recipient_owner_id=current_user.id).first()
     if message and not message.is_read:
         message.is_read = True
+        if not message.is_deleted_by_recipient:
+            User.adjust_unread_count(current_user.id, -1)
+            Conversation.adjust_unread(current_user.id, message.sender_requester_id, message.puzzle_id, -1)
         db.session.commit()
+        # other tabs the user has open update their badge too
+        publish_unread_count(current_user)
         # will return JSON response (jsonify is function by Flask that converts Python dictionary to JSON response)
         # then stored as the response body
         # will be processed by the JS code in the messages.html page 
@@ -542,8 +578,65 @@ def mark_message_as_read(message_id):
     return jsonify({'status': 'failure'})
 
 
+# mark a batch of messages as read in one go (messages.html collects clicks and sends them together)
+# JSON body is either {"message_ids": [1, 2, 3]}, {"sender_id": 4, "puzzle_id": 5, "up_to_id": 99}
+# for everything in that conversation up to and including message 99, or {"all": true} for everything
+@bp.route('/messages/read', methods=['POST'])
+@login_required
+@query_budget(8)
+def mark_messages_as_read():
+    data = request.get_json(silent=True) or {}
+    try:
+        if data.get('all') is True:
+            marked = current_user.mark_all_messages_read()
+        elif 'message_ids' in data:
+            # cap the batch so one request can't build an enormous IN list
+            message_ids = [int(message_id) for message_id in data['message_ids'][:500]]
+            marked = current_user.mark_messages_read(message_ids=message_ids)
+        elif 'sender_id' in data:
+            marked = current_user.mark_messages_read(
+                sender_id=int(data['sender_id']),
+                puzzle_id=int(data['puzzle_id']) if data.get('puzzle_id') is not None else None,
+                up_to_id=int(data['up_to_id']) if data.get('up_to_id') is not None else None
+            )
+        else:
+            return jsonify({'status': 'failure'}), 400
+    except (TypeError, ValueError):
+        return jsonify({'status': 'failure'}), 400
+    db.session.commit()
+    if marked:
+        publish_unread_count(current_user)
+    # the per sender counts come from one grouped query and the total is just their sum
+    unread_counts_by_sender = current_user.unread_message_counts_by_sender()
+    return jsonify({
+        'status': 'success',
+        'marked': marked,
+        'unread_count': sum(unread_counts_by_sender.values()),
+        'unread_counts': unread_counts_by_sender
+    })
+
+
+# live updates for the logged in user (server-sent events) - new messages and unread count changes
+# base.html opens this with EventSource on pages rendered with live_updates=True (the messages page) so replies
+# show up without reloading
+# every open stream holds a worker thread for up to EVENT_STREAM_MAX_SECONDS, so run the app on a threaded or
+# async worker (ie gunicorn --threads or gevent) with room for one per open messages page
+@bp.route('/messages/stream')
+@login_required
+def message_stream():
+    first_event = {'type': 'unread', 'unread_count': current_user.unread_count}
+    stream = event_stream(current_user.id, first_event,
+                          heartbeat=current_app.config.get('EVENT_STREAM_HEARTBEAT', 15),
+                          max_seconds=current_app.config.get('EVENT_STREAM_MAX_SECONDS', 300))
+    response = Response(stream, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # stop nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # ----> SOFT DELETE MESSAGE
-@app.route('/message/delete', methods=['GET', 'POST'])
+@bp.route('/message/delete', methods=['GET', 'POST'])
 @login_required
 def delete_message():
     item_id = request.form.get('message_id')
@@ -556,7 +649,7 @@ def delete_message():
         except Exception as e:
             flash("Something went wrong")
 
-            return redirect(url_for('messages'))
+            return redirect(url_for('main.messages'))
         else:
             if message:
                 # if the sender is the current_user...
@@ -565,21 +658,30 @@ def delete_message():
                     recipient_id = message.recipient_owner_id
                     # change specific boolean to True so will only delete that current user's message, but not recipient
                     message.is_deleted_by_sender = True
+                    Conversation.refresh_deleted(current_user.id, recipient_id, message.puzzle_id)
                     db.session.commit()
                     # if message recipient is the current user...
                 elif message.recipient_owner_id == current_user.id:
                     # recipient will be the sender of the message
                     recipient_id = message.sender_requester_id
+                    # deleting an unread message takes it off the unread count
+                    was_unread = not message.is_read and not message.is_deleted_by_recipient
+                    if was_unread:
+                        User.adjust_unread_count(current_user.id, -1)
+                        Conversation.adjust_unread(current_user.id, recipient_id, message.puzzle_id, -1)
                     message.is_deleted_by_recipient = True
-                    db.session.commit()    
+                    Conversation.refresh_deleted(current_user.id, recipient_id, message.puzzle_id)
+                    db.session.commit()
+                    if was_unread:
+                        publish_unread_count(current_user)    
                 else:
                     flash("Something went wrong") 
-                    return redirect(url_for('messages'))
+                    return redirect(url_for('main.messages'))
                 flash("Your message was successfully deleted")              
-    return redirect(url_for('messages', recipient_id=recipient_id, puzzle_id=message.puzzle_id))
+    return redirect(url_for('main.messages', recipient_id=recipient_id, puzzle_id=message.puzzle_id))
 
 # ACCEPT/DECLINE Request
-@app.route('/request_action', methods=['GET', 'POST'])
+@bp.route('/request_action', methods=['GET', 'POST'])
 @login_required
 def request_action():  
     action = request.form.get('action')
@@ -592,7 +694,7 @@ def request_action():
 
     if not puzzle or not user:
         flash('Puzzle or user not found')
-        return redirect(url_for('messages'))
+        return redirect(url_for('main.messages'))
     if request.method == 'POST':
         
         
@@ -620,7 +722,7 @@ def request_action():
             db.session.commit()
         else:
             flash('Invalid action')
-            return redirect(url_for('messages'))
+            return redirect(url_for('main.messages'))
         
         msg = Message(
                 author=current_user,
@@ -635,53 +737,65 @@ def request_action():
             )
 
         db.session.add(msg)
+        Conversation.record_message(msg)
+        User.adjust_unread_count(user.id, 1)
         db.session.commit()
+        # approving hands the puzzle over, declining puts it back in circulation
+        bump_catalog_version()
+        publish_new_message(msg, user)
 
         if action == 'approve':
             flash(f'You approved the puzzle request for {puzzle.title}. It now belongs to {puzzle.author.username}')
         else:
             flash(f'You declined the puzzle request from {user.username} for {puzzle.title}.')
         
-    return redirect(url_for('messages'))
+    return redirect(url_for('main.messages'))
     
 
-@app.route('/delete/message_thread', methods=['GET','POST'])
+@bp.route('/delete/message_thread', methods=['GET','POST'])
 @login_required
 def delete_message_thread():
-    recipient_id = request.form.get('recipient_id')
-    # id of puzzle requested
-    puzzle_id = request.form.get('puzzle_id_delete')
-    # query for specific puzzle id's messages between the two users
-    messages_between_sender_recipient = []
-    # check to see if there is a conversation between the two users 
-    if recipient_id:
-        recipient = User.query.get(recipient_id)
-        messages_between_sender_recipient = db.session.query(Message).filter(
-
-                and_(
-                ((Message.is_deleted_by_sender == False) & (Message.sender_requester_id == current_user.id)) |
-                ((Message.recipient_owner_id == current_user.id) & (Message.is_deleted_by_recipient == False)),
-
-                ((Message.recipient_owner_id == current_user.id)) & ((Message.sender_requester_id == recipient.id)) |
-                ((Message.recipient_owner_id == recipient.id)) & ((Message.sender_requester_id == current_user.id)),
-                
-                (Message.puzzle_id == puzzle_id)
-            )
-            ).all()
-    if not messages_between_sender_recipient:
+    try:
+        recipient_id = int(request.form.get('recipient_id'))
+        # id of puzzle requested
+        puzzle_id = int(request.form.get('puzzle_id_delete'))
+    except (TypeError, ValueError):
         flash("No messages found.")
-        return redirect(url_for('messages'))
-    # loop through and mark each message's message.is_deleted_by_recipient=True
-    for message in messages_between_sender_recipient:
-       if message.sender_requester_id == current_user.id:
-           message.is_deleted_by_sender = True
-       if message.recipient_owner_id == current_user.id:
-           message.is_deleted_by_recipient = True
+        return redirect(url_for('main.messages'))
+    unread_count = current_user.unread_count
+    # flags every message of the thread on this user's side with a couple of UPDATEs (see User.delete_threads)
+    # instead of loading each message to change it
+    deleted = current_user.delete_threads([(recipient_id, puzzle_id)])
+    if not deleted:
+        flash("No messages found.")
+        return redirect(url_for('main.messages'))
     db.session.commit()
+    if current_user.unread_count != unread_count:
+        publish_unread_count(current_user)
     flash('Message thread successfully deleted.')   
-    return redirect(url_for('messages'))
+    return redirect(url_for('main.messages'))
+
+
+# delete several threads in one go
+# JSON body is {"threads": [[recipient_id, puzzle_id], ...]} - answers with how many messages were deleted
+@bp.route('/delete/message_threads', methods=['POST'])
+@login_required
+@query_budget(8)
+def delete_message_threads():
+    data = request.get_json(silent=True) or {}
+    try:
+        # cap the batch so one request can't build an enormous IN list
+        threads = [(int(recipient_id), int(puzzle_id)) for recipient_id, puzzle_id in data['threads'][:100]]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'status': 'failure'}), 400
+    unread_count = current_user.unread_count
+    deleted = current_user.delete_threads(threads)
+    db.session.commit()
+    if current_user.unread_count != unread_count:
+        publish_unread_count(current_user)
+    return jsonify({'status': 'success', 'deleted': deleted, 'unread_count': current_user.unread_count})
 
-@app.route('/completed', methods=['POST'])
+@bp.route('/completed', methods=['POST'])
 @login_required
 def complete_puzzle():
     puzzle_id = request.form.get('puzzle_id')
@@ -689,7 +803,8 @@ def complete_puzzle():
     puzzle.is_available = True
     puzzle.in_progress = False 
     db.session.commit()
-    return redirect(url_for('user', username=current_user.username))
+    bump_catalog_version()
+    return redirect(url_for('main.user', username=current_user.username))
 
 
 
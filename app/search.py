@@ -0,0 +1,121 @@
+import re
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from app import db
+from app.models import Puzzle, PuzzleSearchTerm
+
+# how much each field counts towards a puzzle's rank when a search term matches it
+FIELD_WEIGHTS = {
+    'title': 5,
+    'categories': 3,
+    'manufacturer': 3,
+    'pieces': 2,
+    'condition': 1,
+    'description': 1,
+}
+
+# ignore anything past this many words so a pasted paragraph can't build a huge query
+MAX_QUERY_TERMS = 8
+
+# same length as the term column on PuzzleSearchTerm
+MAX_TERM_LENGTH = 64
+
+
+# split text into lowercase words ("Ravensburger 1000pc!" -> ['ravensburger', '1000pc'])
+def tokenize(text):
+    if text is None:
+        return []
+    return [word[:MAX_TERM_LENGTH] for word in re.findall(r'\w+', str(text).lower())]
+
+
+# returns {term: weight} for a puzzle, adding up the weights when a term shows up in more than one field
+def puzzle_terms(puzzle):
+    fields = {
+        'title': puzzle.title,
+        'categories': ' '.join(category.name for category in puzzle.categories if category),
+        'manufacturer': puzzle.manufacturer,
+        'pieces': puzzle.pieces,
+        'condition': puzzle.condition,
+        'description': puzzle.description,
+    }
+    terms = {}
+    for field, value in fields.items():
+        for term in set(tokenize(value)):
+            terms[term] = terms.get(term, 0) + FIELD_WEIGHTS[field]
+    return terms
+
+
+# index rows for one puzzle, ready for an insert into PuzzleSearchTerm
+# puzzle can be anything with the searched fields as attributes (bulk loaders pass plain objects)
+def search_rows(puzzle_id, puzzle):
+    return [{'term': term, 'puzzle_id': puzzle_id, 'weight': weight} for term, weight in puzzle_terms(puzzle).items()]
+
+
+# rebuild the index rows for one puzzle - call before committing whenever a puzzle's searchable fields change
+def index_puzzle(puzzle):
+    # a new puzzle needs an id before we can point index rows at it
+    if puzzle.id is None:
+        db.session.flush()
+    unindex_puzzle(puzzle)
+    rows = search_rows(puzzle.id, puzzle)
+    if rows:
+        db.session.execute(sa.insert(PuzzleSearchTerm), rows)
+
+
+# remove a puzzle from the index (deleted puzzles never show up in search)
+def unindex_puzzle(puzzle):
+    db.session.execute(sa.delete(PuzzleSearchTerm).where(PuzzleSearchTerm.puzzle_id == puzzle.id))
+
+
+# rebuild the whole index from the puzzle table (used by `flask search reindex`)
+def reindex_all(batch_size=500):
+    db.session.execute(sa.delete(PuzzleSearchTerm))
+    count = 0
+    # categories come in one extra query per batch rather than one per puzzle
+    puzzles = db.session.scalars(
+        sa.select(Puzzle).where(Puzzle.is_deleted == False)
+        .options(so.selectinload(Puzzle.categories))
+        .execution_options(yield_per=batch_size))
+    rows = []
+    for puzzle in puzzles:
+        rows.extend(search_rows(puzzle.id, puzzle))
+        count += 1
+        if len(rows) >= batch_size:
+            db.session.execute(sa.insert(PuzzleSearchTerm), rows)
+            rows = []
+    if rows:
+        db.session.execute(sa.insert(PuzzleSearchTerm), rows)
+    db.session.commit()
+    return count
+
+
+# builds a select of puzzles matching every word in the query (as a prefix so searching while typing works),
+# best matches first - returns None if the query has no searchable words
+def search_puzzles(query):
+    terms = tokenize(query)[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    # one select per query word, tagged with which word it was so we can require all of them to match
+    # term >= 'puz' AND term < 'puz\uffff' is a prefix match that can still use the primary key index
+    matches = sa.union_all(*[
+        sa.select(
+            PuzzleSearchTerm.puzzle_id,
+            sa.literal(position).label('position'),
+            PuzzleSearchTerm.weight
+        ).where(
+            PuzzleSearchTerm.term >= term,
+            PuzzleSearchTerm.term < term + '\uffff'
+        )
+        for position, term in enumerate(terms)
+    ]).subquery()
+    ranked = sa.select(
+        matches.c.puzzle_id,
+        sa.func.sum(matches.c.weight).label('rank')
+    ).group_by(
+        matches.c.puzzle_id
+    ).having(
+        sa.func.count(sa.distinct(matches.c.position)) == len(terms)
+    ).subquery()
+    return sa.select(Puzzle).join(
+        ranked, ranked.c.puzzle_id == Puzzle.id
+    ).order_by(ranked.c.rank.desc(), Puzzle.timestamp.desc(), Puzzle.id.desc())
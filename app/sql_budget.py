@@ -0,0 +1,102 @@
+import time
+from collections import Counter
+import sqlalchemy as sa
+from flask import Blueprint, current_app, g, has_request_context, request
+from app.metrics import metrics_enabled
+
+# counts the SQL statements each request runs so lazy-loading surprises (N+1 queries) get noticed
+#
+# - views can declare how many statements they're allowed with @query_budget(n)
+# - the same statement run over and over with different parameters (ie one SELECT per card on a page)
+#   counts as an N+1 once it's run SQL_REPEAT_THRESHOLD times (default 5)
+# problems are logged as warnings, or raise QueryBudgetExceeded when SQL_BUDGET_RAISE is set
+# (defaults to on when testing so the tests fail)
+# only checked in debug/testing or when SQL_INSTRUMENTATION is set in app config - statements are still
+# counted otherwise while request metrics are on (app/metrics.py reports them)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+bp = Blueprint('sql_budget', __name__)
+
+
+# put on a view (under @bp.route/@login_required) to say how many statements it should need at most
+def query_budget(max_statements):
+    def decorator(view):
+        # login_required etc use functools.wraps which copies this attribute onto the wrapper
+        view.query_budget = max_statements
+        return view
+    return decorator
+
+
+class RequestSQLStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        # statement text (parameters are placeholders so calls that only differ in parameters match) -> times run
+        self.statements = Counter()
+
+
+def instrumentation_enabled():
+    return current_app.debug or current_app.testing or current_app.config.get('SQL_INSTRUMENTATION', False)
+
+
+# stats for the current request, or None outside a request / when instrumentation is off
+def current_stats():
+    if not has_request_context():
+        return None
+    return g.get('sql_stats')
+
+
+# listening on the Engine class catches every engine the app creates
+@sa.event.listens_for(sa.engine.Engine, 'before_cursor_execute')
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    stats = current_stats()
+    if stats is not None:
+        stats.count += 1
+        stats.statements[statement] += 1
+        connection.info.setdefault('sql_started', []).append(time.perf_counter())
+
+
+@sa.event.listens_for(sa.engine.Engine, 'after_cursor_execute')
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    stats = current_stats()
+    started = connection.info.get('sql_started')
+    if stats is not None and started:
+        stats.seconds += time.perf_counter() - started.pop()
+
+
+@bp.before_app_request
+def start_sql_stats():
+    if instrumentation_enabled() or metrics_enabled():
+        g.sql_stats = RequestSQLStats()
+
+
+# works out what's wrong with the request's SQL, if anything - returns a list of messages
+def sql_problems(stats, budget):
+    problems = []
+    if budget is not None and stats.count > budget:
+        problems.append(f'{stats.count} SQL statements, budget is {budget}')
+    threshold = current_app.config.get('SQL_REPEAT_THRESHOLD', 5)
+    for statement, times in stats.statements.most_common():
+        if times < threshold:
+            break
+        problems.append(f'possible N+1: ran {times} times: {" ".join(statement.split())[:200]}')
+    return problems
+
+
+@bp.after_app_request
+def check_sql_budget(response):
+    stats = current_stats()
+    if stats is None or request.endpoint is None or not instrumentation_enabled():
+        return response
+    view = current_app.view_functions.get(request.endpoint)
+    problems = sql_problems(stats, getattr(view, 'query_budget', None))
+    if problems:
+        message = f'{request.method} {request.path} ({request.endpoint}): ' + '; '.join(problems)
+        if current_app.config.get('SQL_BUDGET_RAISE', current_app.testing):
+            raise QueryBudgetExceeded(message)
+        current_app.logger.warning(message)
+    return response
@@ -0,0 +1,33 @@
+import re
+import subprocess
+import sys
+
+# how long a fresh process takes to import the app and build it with create_app() - this is what every
+# worker, cli command and test run pays before doing anything (run with `flask startup check`)
+# STARTUP_BUDGET in app config is the limit in seconds (default 1.5 - -X importtime slows imports down a little itself)
+
+IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)')
+
+# run in a new interpreter so nothing is already imported
+SCRIPT = '''
+import time
+started = time.perf_counter()
+from app import create_app
+create_app()
+print(time.perf_counter() - started)
+'''
+
+
+# returns (seconds, [(cumulative seconds, module), ...] heaviest first) for the top level imports
+def measure_startup():
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', SCRIPT], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'startup failed')
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        # two spaces of indent means the module was imported directly rather than by another import
+        if match and len(match.group(3)) == 2:
+            modules.append((int(match.group(2)) / 1_000_000, match.group(4)))
+    modules.sort(reverse=True)
+    return float(result.stdout.strip().splitlines()[-1]), modules
@@ -0,0 +1,34 @@
+import sqlalchemy as sa
+from flask import current_app
+from app.models import Message
+from app.pagination import keyset_paginate
+from app.loaders import with_thread_messages
+
+# the messages of one conversation (two users, one puzzle) as one of them sees it - the messages page shows the
+# newest THREAD_PAGE_SIZE of them (default 30) and messages.html asks /messages/older for the rest as the user
+# scrolls up, so a long negotiation costs the same to open as a short one
+
+
+# the messages between user_id and other_id about puzzle_id that user_id hasn't deleted, as the two directions
+# they were sent in - each is an equality on (sender, recipient, puzzle), so each is a range of ix_message_thread
+# in timestamp order, where the OR of them can only use an index to find the rows and then has to sort them
+def thread_directions(user_id, other_id, puzzle_id):
+    return (
+        (Message.sender_requester_id == user_id, Message.recipient_owner_id == other_id,
+         Message.puzzle_id == puzzle_id, Message.is_deleted_by_sender == False),
+        (Message.sender_requester_id == other_id, Message.recipient_owner_id == user_id,
+         Message.puzzle_id == puzzle_id, Message.is_deleted_by_recipient == False)
+    )
+
+
+def thread_page_size():
+    return current_app.config.get('THREAD_PAGE_SIZE', 30)
+
+
+# one page of the thread, newest first - cursor is the next_cursor of the page before (None for the newest messages)
+# items come back oldest first, ready to show top to bottom, and next_cursor points at the messages older than them
+def thread_page(user_id, other_id, puzzle_id, cursor=None):
+    page = keyset_paginate(with_thread_messages(sa.select(Message)), Message.timestamp, Message.id, cursor=cursor,
+                           per_page=thread_page_size(), branches=thread_directions(user_id, other_id, puzzle_id))
+    page.items.reverse()
+    return page
@@ -0,0 +1,71 @@
+import hashlib
+import os
+import re
+import tempfile
+from flask import send_from_directory
+from flask_uploads import UploadNotAllowed, extension
+from config import Config
+
+# uploads are stored under the sha256 of their contents (ie 9f86d0...0a08.jpg) so the same image uploaded
+# twice is only stored once, and a url always points at the same bytes - which lets browsers cache them forever
+CONTENT_ADDRESSED_NAME = re.compile(r'^(?P<digest>[0-9a-f]{64})(?:_(?P<variant>\w+))?\.\w+$')
+
+# one year - the longest max-age browsers take notice of
+IMMUTABLE_MAX_AGE = 31536000
+
+# older uploads saved under their original filename can still be replaced, so only cache those for a bit
+LEGACY_MAX_AGE = 3600
+
+
+# saves a FileStorage from a form and returns the filename it's stored under
+# raises UploadNotAllowed if the extension isn't one Config.photos accepts
+def save_upload(storage):
+    ext = extension(storage.filename or '').lower()
+    if not Config.photos.extension_allowed(ext):
+        raise UploadNotAllowed()
+    folder = Config.UPLOADED_PHOTOS_DEST
+    os.makedirs(folder, exist_ok=True)
+
+    # hash while copying to a temp file in the same folder so we only read the upload once
+    digest = hashlib.sha256()
+    storage.stream.seek(0)
+    descriptor, temp_path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+    try:
+        with os.fdopen(descriptor, 'wb') as temp_file:
+            for chunk in iter(lambda: storage.stream.read(64 * 1024), b''):
+                digest.update(chunk)
+                temp_file.write(chunk)
+        filename = f'{digest.hexdigest()}.{ext}'
+        path = os.path.join(folder, filename)
+        if os.path.exists(path):
+            # already have these exact bytes
+            os.remove(temp_path)
+        else:
+            # mkstemp makes the file private to us - uploads need to be readable like any other static file
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return filename
+
+
+def is_content_addressed(filename):
+    return CONTENT_ADDRESSED_NAME.match(filename) is not None
+
+
+# serve an upload with caching headers
+# send_from_directory already answers If-None-Match/If-Modified-Since with a 304 and Range with a 206
+def send_upload(filename):
+    match = CONTENT_ADDRESSED_NAME.match(filename)
+    if match:
+        # the name is the content hash, so it doubles as a strong etag
+        etag = match.group('digest') + (f"-{match.group('variant')}" if match.group('variant') else '')
+        response = send_from_directory(Config.UPLOADED_PHOTOS_DEST, filename, etag=etag, max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        response = send_from_directory(Config.UPLOADED_PHOTOS_DEST, filename, max_age=LEGACY_MAX_AGE)
+        response.cache_control.public = True
+    return response
@@ -0,0 +1,42 @@
+"""add message and puzzle query indexes
+
+Revision ID: 2f41d84fea91
+Revises: d6a3f71e0b28
+Create Date: 2026-10-18 15:41:07.218334
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f41d84fea91'
+down_revision = 'd6a3f71e0b28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index('ix_message_unread_by_sender', ['recipient_owner_id', 'sender_requester_id', 'puzzle_id'], unique=False,
+                              sqlite_where=sa.text('is_read = 0 AND is_deleted_by_recipient = 0'),
+                              postgresql_where=sa.text('is_read = false AND is_deleted_by_recipient = false'))
+        batch_op.create_index('ix_message_thread', ['sender_requester_id', 'recipient_owner_id', 'puzzle_id', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('puzzle', schema=None) as batch_op:
+        batch_op.create_index('ix_puzzle_feed', ['timestamp', 'id'], unique=False,
+                              sqlite_where=sa.text('is_available = 1'),
+                              postgresql_where=sa.text('is_available = true'))
+        batch_op.create_index('ix_puzzle_user_active', ['user_id', 'timestamp'], unique=False,
+                              sqlite_where=sa.text('is_deleted = 0'),
+                              postgresql_where=sa.text('is_deleted = false'))
+
+
+def downgrade():
+    with op.batch_alter_table('puzzle', schema=None) as batch_op:
+        batch_op.drop_index('ix_puzzle_user_active')
+        batch_op.drop_index('ix_puzzle_feed')
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_thread')
+        batch_op.drop_index('ix_message_unread_by_sender')
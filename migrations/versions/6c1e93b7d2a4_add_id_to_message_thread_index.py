@@ -0,0 +1,28 @@
+"""add id to message thread index
+
+Revision ID: 6c1e93b7d2a4
+Revises: a418816245f8
+Create Date: 2026-10-18 19:12:44.803517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c1e93b7d2a4'
+down_revision = 'a418816245f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_thread')
+        batch_op.create_index('ix_message_thread', ['sender_requester_id', 'recipient_owner_id', 'puzzle_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_thread')
+        batch_op.create_index('ix_message_thread', ['sender_requester_id', 'recipient_owner_id', 'puzzle_id', 'timestamp'], unique=False)
@@ -1,7 +1,10 @@
-from app import app, db
+from app import create_app, db
 import sqlalchemy as sa
 import sqlalchemy.orm as so
-from app.models import User, Puzzle, Category, Message
+from app.models import User, Puzzle, Category, Message, PuzzleSearchTerm
+
+# the app `flask run` / `flask <command>` and wsgi servers (puzzle_post:app) use
+app = create_app()
 
 # configuring a flask shell (python interpreter) within the application
 # so it can recognize everything within your app and 
@@ -15,5 +18,6 @@ def make_shell_context():
         'User': User,
         'Puzzle': Puzzle,
         'Category': Category,
-        'Message': Message
+        'Message': Message,
+        'PuzzleSearchTerm': PuzzleSearchTerm
     }
\ No newline at end of file
@@ -0,0 +1,140 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import pytest
+import sqlalchemy as sa
+from config import Config
+from app import create_app, db
+from app.cache import feed_cache
+from app.fragments import fragment_cache
+from app.models import User, Puzzle, Category, Message, Conversation
+
+# every test gets an app of its own with a throwaway sqlite database (see create_app in app/__init__.py)
+# TESTING turns on the SQL checks, so a view that blows its @query_budget or runs an N+1 fails the test
+#
+# no app context is left pushed while a test runs, so every test client request gets a fresh one (its own
+# session and g) like a real request does - use `with app.app_context():` to look at the database in a test
+# the make_* fixtures hand back rows already loaded and detached, so their columns can be read anywhere
+
+
+# make_app(**settings) builds another app with a database of its own - settings are extra config
+@pytest.fixture
+def make_app(tmp_path):
+    apps = []
+
+    def make_app(**settings):
+        class TestConfig(Config):
+            TESTING = True
+            WTF_CSRF_ENABLED = False
+            SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / f"app{len(apps)}.db"}'
+            SQLALCHEMY_REPLICA_URIS = []
+            # a real hash would make every user take a good part of a second to set up
+            PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1'
+            IMAGE_VARIANTS_SYNC = True
+
+        for name, value in settings.items():
+            setattr(TestConfig, name, value)
+        app = create_app(TestConfig)
+        with app.app_context():
+            db.create_all()
+        apps.append(app)
+        return app
+
+    # the caches are shared by every app in the process
+    feed_cache.clear()
+    fragment_cache.clear()
+    yield make_app
+    for app in apps:
+        with app.app_context():
+            db.engine.dispose()
+        for engine in app.extensions['replica_engines']:
+            engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# log the test client in as user without going through the login form
+@pytest.fixture
+def login(client):
+    def login(user):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+    return login
+
+
+# commits row and hands it back loaded and detached
+def _save(row):
+    db.session.add(row)
+    db.session.commit()
+    db.session.refresh(row)
+    db.session.expunge(row)
+    return row
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(username):
+        with app.app_context():
+            user = User(username=username, email=f'{username}@example.com')
+            user.set_password('password')
+            return _save(user)
+    return make_user
+
+
+# categories are names, made as needed
+@pytest.fixture
+def make_puzzle(app):
+    def make_puzzle(owner, title='Mountain lake', categories=()):
+        with app.app_context():
+            puzzle = Puzzle(user_id=owner.id, title=title, pieces=1000, manufacturer='Ravensburger', condition='Good',
+                            description='', image_url='/uploads/puzzle.png', is_available=True, is_requested=False,
+                            in_progress=False, is_deleted=False)
+            for name in categories:
+                puzzle.categories.append(db.session.scalar(sa.select(Category).where(Category.name == name))
+                                         or Category(name=name))
+            return _save(puzzle)
+    return make_puzzle
+
+
+# a message from sender to recipient about puzzle, stored the way send_message stores one
+@pytest.fixture
+def make_message(app):
+    def make_message(sender, recipient, puzzle, content='Is this still available?', timestamp=None):
+        with app.app_context():
+            message = Message(sender_requester_id=sender.id, recipient_owner_id=recipient.id, puzzle_id=puzzle.id,
+                              content=content, timestamp=timestamp or datetime.now(timezone.utc), is_read=False,
+                              is_deleted_by_sender=False, is_deleted_by_recipient=False, is_automated=False)
+            db.session.add(message)
+            Conversation.record_message(message)
+            User.adjust_unread_count(recipient.id, 1)
+            return _save(message)
+    return make_message
+
+
+# with count_queries() as queries: ... - queries is the list of statements run inside the block
+@pytest.fixture
+def count_queries(app):
+    with app.app_context():
+        engine = db.engine
+
+    @contextmanager
+    def count_queries():
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        sa.event.listen(engine, 'before_cursor_execute', capture)
+        try:
+            yield statements
+        finally:
+            sa.event.remove(engine, 'before_cursor_execute', capture)
+    return count_queries
@@ -0,0 +1,35 @@
+import sqlalchemy as sa
+from app import db
+from app.models import User
+from app.events import get_broker
+from app.passwords import hash_password, verify_password
+
+
+# apps built in the same process (ie one per test) mustn't share anything that points at a database or config
+def test_apps_record_last_seen_in_their_own_database(make_app):
+    apps = [make_app(LAST_SEEN_FLUSH_INTERVAL=0), make_app(LAST_SEEN_FLUSH_INTERVAL=0)]
+    for app in apps:
+        with app.app_context():
+            user = User(username='owner', email='owner@example.com')
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+            db.session.execute(sa.update(User).values(last_seen=None))
+            db.session.commit()
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        client.get('/index')
+        with app.app_context():
+            assert db.session.scalar(sa.select(User.last_seen).where(User.id == user_id)) is not None
+
+
+def test_apps_get_their_own_broker_and_hashing_pool(make_app):
+    first, second = make_app(), make_app(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=0)
+    with first.app_context():
+        first_broker = get_broker()
+        assert verify_password(hash_password('secret'), 'secret')
+    with second.app_context():
+        assert get_broker() is not first_broker
+        assert verify_password(hash_password('secret'), 'secret')
+    assert first.extensions['password_hashing'] is not second.extensions['password_hashing']
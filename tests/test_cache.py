@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+from app.cache import cached_page, bump_catalog_version
+
+
+# a page loaded while the catalog changed must not be served for the new version
+def test_page_loaded_across_a_version_bump_is_not_cached(app):
+    loads = []
+
+    def load_while_catalog_changes():
+        loads.append(1)
+        bump_catalog_version()
+        return SimpleNamespace(items=[])
+
+    with app.test_request_context():
+        cached_page('feed', load_while_catalog_changes)
+        cached_page('feed', load_while_catalog_changes)
+    assert len(loads) == 2
+
+
+def test_page_is_cached_until_the_catalog_changes(app):
+    loads = []
+
+    def load():
+        loads.append(1)
+        return SimpleNamespace(items=[])
+
+    with app.test_request_context():
+        cached_page('feed', load)
+        cached_page('feed', load)
+        assert len(loads) == 1
+        bump_catalog_version()
+        cached_page('feed', load)
+        assert len(loads) == 2
+
+
+# feed pages are cached with their puzzles' authors, so a new username has to show up on them straight away
+def test_feed_shows_a_changed_username(app, make_user, make_puzzle):
+    owner, viewer = make_user('owner'), make_user('viewer')
+    make_puzzle(owner)
+    owner_client, viewer_client = app.test_client(), app.test_client()
+    for client, user in ((owner_client, owner), (viewer_client, viewer)):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+    assert 'owner' in viewer_client.get('/index').get_data(as_text=True)
+    response = owner_client.post('/edit_profile', data={'username': 'renamed', 'about_me': ''})
+    assert response.status_code == 302
+    feed = viewer_client.get('/index').get_data(as_text=True)
+    assert 'renamed' in feed and '>owner<' not in feed
@@ -0,0 +1,22 @@
+import json
+import sqlalchemy as sa
+from app import db
+from app.models import Puzzle
+
+
+def test_import_cuts_text_to_the_column_lengths(app, make_user, tmp_path):
+    make_user('owner')
+    path = tmp_path / 'puzzles.jsonl'
+    rows = [
+        {'title': 'T' * 100, 'pieces': 500, 'condition': 'C' * 100, 'manufacturer': 'M' * 100,
+         'description': 'D' * 300, 'owner': 'owner'},
+        {'title': '', 'pieces': 500, 'owner': 'owner'},
+        {'title': 'Lighthouse', 'pieces': 'lots', 'owner': 'owner'},
+    ]
+    path.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+    result = app.test_cli_runner().invoke(args=['catalog', 'import', str(path)])
+    assert result.exit_code == 0, result.output
+    assert 'Imported 1 puzzles, skipped 2' in result.output
+    with app.app_context():
+        puzzle = db.session.scalar(sa.select(Puzzle))
+        assert (len(puzzle.title), len(puzzle.condition), len(puzzle.manufacturer), len(puzzle.description)) == (64, 64, 64, 120)
@@ -0,0 +1,32 @@
+import re
+from app.events import event_stream, get_broker
+
+
+def test_stream_hands_on_a_published_event(app):
+    with app.app_context():
+        stream = event_stream(7, {'type': 'unread', 'unread_count': 2}, heartbeat=0.05, max_seconds=5)
+        assert next(stream) == 'retry: 3000\n\n'
+        assert next(stream) == 'event: unread\ndata: {"type": "unread", "unread_count": 2}\n\n'
+        get_broker().publish(7, {'type': 'unread', 'unread_count': 3})
+        assert next(stream) == 'event: unread\ndata: {"type": "unread", "unread_count": 3}\n\n'
+        # nothing waiting - a heartbeat keeps the connection open
+        assert next(stream) == ': keepalive\n\n'
+        stream.close()
+        assert get_broker()._subscribers == {}
+
+
+# only the messages page holds a stream open
+def test_only_the_messages_page_opens_the_stream(client, login, make_user):
+    login(make_user('owner'))
+    assert 'EventSource' not in client.get('/index').get_data(as_text=True)
+    assert 'EventSource' in client.get('/messages').get_data(as_text=True)
+
+
+def test_stream_is_left_out_of_request_durations(client, login, make_user):
+    login(make_user('owner'))
+    response = client.get('/messages/stream')
+    assert response.status_code == 200
+    response.close()
+    body = client.get('/metrics').get_data(as_text=True)
+    assert re.search(r'^http_requests_total\{endpoint="main.message_stream"', body, re.M)
+    assert not re.search(r'^http_request_duration_seconds\w*\{endpoint="main.message_stream"', body, re.M)
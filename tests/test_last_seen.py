@@ -0,0 +1,36 @@
+import pytest
+import sqlalchemy as sa
+from app import db
+from app.last_seen import current_tracker
+from app.models import User
+
+
+@pytest.fixture
+def app(make_app):
+    # every request from a logged in user is due a flush
+    return make_app(LAST_SEEN_FLUSH_INTERVAL=0)
+
+
+# a flush that can't write doesn't fail the request it ran in - the times wait for the next one
+def test_failed_flush_keeps_the_request_and_the_times(app, client, login, make_user, tmp_path, caplog):
+    user = make_user('owner')
+    login(user)
+    with app.app_context():
+        tracker = current_tracker()
+    engine = tracker._engine
+    # a database without a user table, so the UPDATE fails
+    tracker._engine = sa.create_engine(f'sqlite:///{tmp_path / "broken.db"}')
+    try:
+        assert client.get('/index').status_code == 200
+    finally:
+        tracker._engine.dispose()
+        tracker._engine = engine
+    assert 'Could not write last_seen' in caplog.text
+    assert user.id in tracker._pending
+    with app.app_context():
+        assert db.session.get(User, user.id).last_seen == user.last_seen
+
+    assert client.get('/index').status_code == 200
+    assert tracker._pending == {}
+    with app.app_context():
+        assert db.session.get(User, user.id).last_seen > user.last_seen
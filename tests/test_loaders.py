@@ -0,0 +1,30 @@
+import sqlalchemy as sa
+from app import db
+from app.loaders import with_puzzle_cards, with_thread_messages
+from app.models import Puzzle, Message
+
+
+# a page of cards is two queries however many puzzles, authors and categories it has
+def test_puzzle_cards_load_authors_and_categories_up_front(app, count_queries, make_user, make_puzzle):
+    for number in range(4):
+        owner = make_user(f'owner{number}')
+        make_puzzle(owner, title=f'Puzzle {number}', categories=['Landscape', f'Category {number}'])
+    with app.app_context(), count_queries() as queries:
+        puzzles = db.session.scalars(with_puzzle_cards(sa.select(Puzzle).order_by(Puzzle.id))).unique().all()
+        cards = [(puzzle.author.username, sorted(category.name for category in puzzle.categories)) for puzzle in puzzles]
+    assert cards == [(f'owner{number}', [f'Category {number}', 'Landscape']) for number in range(4)]
+    assert len(queries) == 2
+
+
+# a thread renders from the one query that loads it
+def test_thread_messages_load_author_recipient_and_puzzle(app, count_queries, make_user, make_puzzle, make_message):
+    owner, buyer = make_user('owner'), make_user('buyer')
+    puzzle = make_puzzle(owner)
+    for number in range(3):
+        make_message(buyer, owner, puzzle, content=f'Question {number}')
+        make_message(owner, buyer, puzzle, content=f'Answer {number}')
+    with app.app_context(), count_queries() as queries:
+        messages = db.session.scalars(with_thread_messages(sa.select(Message).order_by(Message.id))).all()
+        shown = [(message.author.username, message.recipient.username, message.puzzle.title) for message in messages]
+    assert shown == [('buyer', 'owner', 'Mountain lake'), ('owner', 'buyer', 'Mountain lake')] * 3
+    assert len(queries) == 1
@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+from app import db
+from app.models import User, Message, Conversation
+
+# the sidebar lists everyone the user trades with - more of them must not mean more queries
+def test_messages_page_query_count_does_not_grow_with_partners(client, login, count_queries, make_user, make_puzzle, make_message):
+    owner = make_user('owner')
+    puzzle = make_puzzle(owner)
+    login(owner)
+
+    partners = []
+
+    def add_partners(count):
+        for _ in range(count):
+            partner = make_user(f'partner{len(partners) + 1}')
+            partners.append(partner)
+            make_message(partner, owner, puzzle)
+            make_message(owner, partner, puzzle, content='It is!')
+
+    def messages_page_queries():
+        with count_queries() as queries:
+            response = client.get('/messages')
+        assert response.status_code == 200
+        return response, len(queries)
+
+    add_partners(3)
+    _, few = messages_page_queries()
+    add_partners(3)
+    response, many = messages_page_queries()
+    assert many == few
+    for number in range(1, 7):
+        assert f'partner{number}' in response.get_data(as_text=True)
+
+
+def test_deleting_threads_takes_their_unread_messages_off_the_count(app, client, login, make_user, make_puzzle, make_message):
+    owner = make_user('owner')
+    puzzle = make_puzzle(owner)
+    reader, other = make_user('reader'), make_user('other')
+    first = make_message(reader, owner, puzzle)
+    make_message(reader, owner, puzzle, content='Still there?')
+    make_message(other, owner, puzzle)
+    login(owner)
+    assert client.post('/messages/read', json={'message_ids': [first.id]}).status_code == 200
+    response = client.post('/delete/message_threads', json={'threads': [[reader.id, puzzle.id]]})
+    assert response.status_code == 200
+    with app.app_context():
+        # the read message didn't count, the other thread is untouched
+        assert db.session.get(User, owner.id).unread_count == 1
+        assert db.session.get(Conversation, Conversation.key(owner.id, other.id, puzzle.id)).unread_count_for(owner.id) == 1
+
+
+# marking a batch read takes each conversation's share off its own count without an UPDATE per conversation
+def test_marking_messages_from_many_senders_read(app, client, login, make_user, make_puzzle, make_message):
+    # senders on both sides of the owner's id, so the owner is user_a of some conversations and user_b of others
+    senders = [make_user(f'sender{number}') for number in range(3)]
+    owner = make_user('owner')
+    senders += [make_user(f'sender{number}') for number in range(3, 6)]
+    puzzle = make_puzzle(owner)
+    marked = [make_message(sender, owner, puzzle).id for sender in senders]
+    marked.append(make_message(senders[0], owner, puzzle, content='Still there?').id)
+    make_message(senders[5], owner, puzzle, content='Still there?')
+    login(owner)
+    response = client.post('/messages/read', json={'message_ids': marked})
+    assert response.status_code == 200
+    assert response.get_json()['marked'] == 7
+    with app.app_context():
+        unread = {sender.id: db.session.get(Conversation, Conversation.key(owner.id, sender.id, puzzle.id)).unread_count_for(owner.id)
+                  for sender in senders}
+        assert unread == {sender.id: 1 if sender is senders[5] else 0 for sender in senders}
+        assert db.session.get(User, owner.id).unread_count == 1
+
+
+def test_mark_read_batches_are_capped_and_all_marks_the_rest(app, client, login, make_user, make_puzzle):
+    owner, buyer = make_user('owner'), make_user('buyer')
+    puzzle = make_puzzle(owner)
+    with app.app_context():
+        now = datetime.now(timezone.utc)
+        messages = [Message(sender_requester_id=buyer.id, recipient_owner_id=owner.id, puzzle_id=puzzle.id,
+                            content=f'Message {number}', timestamp=now, is_read=False, is_deleted_by_sender=False,
+                            is_deleted_by_recipient=False, is_automated=False) for number in range(501)]
+        db.session.add_all(messages)
+        db.session.commit()
+        message_ids = [message.id for message in messages]
+        Conversation.rebuild()
+        User.reconcile_unread_counts()
+    login(owner)
+
+    # only the first 500 ids are looked at
+    response = client.post('/messages/read', json={'message_ids': message_ids})
+    assert response.status_code == 200
+    assert response.get_json()['marked'] == 500
+    assert response.get_json()['unread_count'] == 1
+
+    response = client.post('/messages/read', json={'all': True})
+    assert response.get_json()['marked'] == 1
+    with app.app_context():
+        assert db.session.get(User, owner.id).unread_count == 0
+        assert db.session.get(Conversation, Conversation.key(owner.id, buyer.id, puzzle.id)).unread_count_for(owner.id) == 0
@@ -0,0 +1,37 @@
+import re
+import threading
+from app.metrics import MetricsRegistry
+
+
+# werkzeug's threaded server starts a thread per request - the registry mustn't grow with them
+def test_registry_size_does_not_grow_with_threads():
+    registry = MetricsRegistry(shards=4)
+
+    def record():
+        registry.inc('http_requests_total', (('endpoint', 'main.index'),))
+        registry.observe('http_request_duration_seconds', (('endpoint', 'main.index'),), 0.02)
+
+    for _ in range(50):
+        thread = threading.Thread(target=record)
+        thread.start()
+        thread.join()
+
+    assert len(registry._shards) == 4
+    total = registry.collect()
+    assert total.counters[('http_requests_total', (('endpoint', 'main.index'),))] == 50
+    histogram = total.histograms[('http_request_duration_seconds', (('endpoint', 'main.index'),))]
+    assert histogram[-1] == 50
+    assert histogram[2] == 50
+
+
+def test_metrics_endpoint_counts_requests(client):
+    # the registry is shared by every app in the process, so look at how much the count goes up
+    def login_requests():
+        body = client.get('/metrics').get_data(as_text=True)
+        match = re.search(r'^http_requests_total\{endpoint="main.login",method="GET",status="200"\} (\d+)$', body, re.M)
+        return int(match.group(1)) if match else 0
+
+    before = login_requests()
+    client.get('/login')
+    client.get('/login')
+    assert login_requests() == before + 2
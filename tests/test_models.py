@@ -0,0 +1,52 @@
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from app import db
+from app.models import User, Puzzle, Category, Message
+
+
+# two requests editing the same puzzle from the same starting version must each make a new version
+def test_puzzle_version_goes_up_once_per_edit(app, make_user, make_puzzle):
+    puzzle_id = make_puzzle(make_user('owner')).id
+    with app.app_context():
+        puzzle = db.session.get(Puzzle, puzzle_id)
+        assert puzzle.version == 1
+        with so.Session(db.engine) as other_session:
+            other = other_session.get(Puzzle, puzzle_id)
+            assert other.version == 1
+            other.description = 'Edited there'
+            other_session.commit()
+        puzzle.title = 'Edited here'
+        db.session.commit()
+        assert puzzle.version == 3
+
+
+def test_puzzle_version_stays_put_when_nothing_changed(app, make_user, make_puzzle):
+    puzzle_id = make_puzzle(make_user('owner')).id
+    with app.app_context():
+        puzzle = db.session.get(Puzzle, puzzle_id)
+        puzzle.is_available = True
+        db.session.commit()
+        assert puzzle.version == 1
+        puzzle.categories.append(Category(name='Art'))
+        db.session.commit()
+        assert puzzle.version == 2
+
+
+# counts that have drifted from the messages are put back, counts that are right are left alone
+def test_reconcile_unread_counts(app, make_user, make_puzzle, make_message):
+    owner, buyer, bystander = make_user('owner'), make_user('buyer'), make_user('bystander')
+    puzzle = make_puzzle(owner)
+    make_message(buyer, owner, puzzle)
+    read = make_message(buyer, owner, puzzle, content='Still there?')
+    deleted = make_message(owner, buyer, puzzle, content='Yes')
+    with app.app_context():
+        db.session.execute(sa.update(Message).where(Message.id == read.id).values(is_read=True))
+        db.session.execute(sa.update(Message).where(Message.id == deleted.id).values(is_deleted_by_recipient=True))
+        db.session.execute(sa.update(User).where(User.id == bystander.id).values(unread_count=4))
+        db.session.commit()
+        assert User.reconcile_unread_counts() == 3
+        counts = dict(db.session.execute(sa.select(User.username, User.unread_count)).all())
+        assert counts == {'owner': 1, 'buyer': 0, 'bystander': 0}
+        assert User.reconcile_unread_counts() == 0
+    result = app.test_cli_runner().invoke(args=['messages', 'reconcile-unread'])
+    assert result.output == 'Fixed unread count for 0 users\n'
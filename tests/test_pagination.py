@@ -0,0 +1,73 @@
+import re
+from datetime import datetime, timedelta, timezone
+from html import unescape
+import sqlalchemy as sa
+from app import db
+from app.models import Puzzle
+
+
+def add_puzzles(app, owner, count):
+    now = datetime.now(timezone.utc)
+    with app.app_context():
+        # pairs of puzzles share a timestamp so the id has to break the tie
+        puzzles = [Puzzle(user_id=owner.id, title=f'Puzzle {number}', pieces=500, manufacturer='Ravensburger',
+                          image_url='/uploads/puzzle.png', timestamp=now - timedelta(minutes=number // 2),
+                          is_available=True, is_requested=False, in_progress=False, is_deleted=False)
+                   for number in range(count)]
+        db.session.add_all(puzzles)
+        db.session.commit()
+        return [puzzle.id for puzzle in sorted(puzzles, key=lambda puzzle: (puzzle.timestamp, puzzle.id), reverse=True)]
+
+
+def page(client, url):
+    body = client.get(url).get_data(as_text=True)
+    ids = [int(id) for id in re.findall(r'id="puzzle-(\d+)"', body)]
+    links = {label: unescape(href) for href, label in re.findall(r'href="(/index\?cursor=[^"]+)">(Next|Previous)<', body)}
+    return ids, links
+
+
+def test_feed_pages_forwards_and_back(app, client, login, make_user):
+    newest_first = add_puzzles(app, make_user('owner'), 15)
+    login(make_user('viewer'))
+
+    pages, url = [], '/index'
+    while url:
+        ids, links = page(client, url)
+        pages.append(ids)
+        url = links.get('Next')
+    assert [len(ids) for ids in pages] == [6, 6, 3]
+    assert [id for ids in pages for id in ids] == newest_first
+
+    # and back again from the last page with the Previous links
+    ids, links = page(client, '/index')
+    ids, links = page(client, links['Next'])
+    ids, links = page(client, links['Next'])
+    back = []
+    while 'Previous' in links:
+        ids, links = page(client, links['Previous'])
+        back.append(ids)
+    assert back == [pages[1], pages[0]]
+
+
+# a page past the first is a range on ix_puzzle_feed, not a walk down the index from the newest puzzle
+def test_feed_page_seeks_the_feed_index(app, client, login, make_user):
+    add_puzzles(app, make_user('owner'), 15)
+    login(make_user('viewer'))
+    _, links = page(client, '/index')
+    with app.app_context():
+        engine = db.engine
+    executed = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        executed.append((statement, parameters))
+
+    sa.event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        page(client, links['Next'])
+    finally:
+        sa.event.remove(engine, 'before_cursor_execute', capture)
+    statement, parameters = next((statement, parameters) for statement, parameters in executed
+                                 if statement.lstrip().startswith('SELECT') and 'FROM puzzle' in statement)
+    with engine.connect() as connection:
+        plan = [row[-1] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+    assert any(re.match(r'SEARCH puzzle USING INDEX ix_puzzle_feed \(.*<', line) for line in plan), plan
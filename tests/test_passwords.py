@@ -0,0 +1,41 @@
+from app import db
+from app.models import User
+from app.passwords import _get_pool
+
+
+def log_in(client, username='owner', password='password'):
+    return client.post('/login', data={'username': username, 'password': password})
+
+
+# a hash made with older settings is redone with the current ones the next time the user logs in
+def test_login_rehashes_an_old_hash(app, client, make_user):
+    user = make_user('owner')
+    assert user.password_hash.startswith('pbkdf2:sha256:1$')
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2'
+    assert log_in(client).status_code == 302
+    with app.app_context():
+        user = db.session.get(User, user.id)
+        assert user.password_hash.startswith('pbkdf2:sha256:2$')
+        assert user.check_password('password')
+        assert not user.password_needs_rehash()
+
+
+def test_login_is_turned_away_while_the_hashing_pool_is_full(make_app):
+    app = make_app(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=0)
+    # make_user makes users on the default app, so this one's is made here
+    with app.app_context():
+        user = User(username='owner', email='owner@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        _, slots = _get_pool()
+    client = app.test_client()
+    # somebody else's password is being hashed
+    slots.acquire()
+    try:
+        response = log_in(client)
+        assert response.status_code == 503
+        assert 'please try again in a moment' in response.get_data(as_text=True)
+    finally:
+        slots.release()
+    assert log_in(client).status_code == 302
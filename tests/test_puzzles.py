@@ -0,0 +1,58 @@
+import io
+import sqlalchemy as sa
+from PIL import Image
+from config import Config
+from app import db
+from app.models import Puzzle, Category
+
+
+def puzzle_form(**fields):
+    return {'title': 'Starry night', 'pieces': '1000', 'condition': 'Good', 'manufacturer': 'Ravensburger',
+            'description': 'All pieces there', **fields}
+
+
+def png():
+    image = io.BytesIO()
+    Image.new('RGB', (8, 8), 'navy').save(image, 'PNG')
+    image.seek(0)
+    return image
+
+
+def category_ids(app, *names):
+    with app.app_context():
+        return [db.session.scalar(sa.select(Category.id).where(Category.name == name)) for name in names]
+
+
+def test_new_puzzle_is_saved_with_its_categories(app, client, login, make_user, make_puzzle, monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'UPLOADED_PHOTOS_DEST', str(tmp_path / 'uploads'))
+    owner = make_user('owner')
+    # makes the categories
+    make_puzzle(owner, categories=['Art', 'Landscape'])
+    art, = category_ids(app, 'Art')
+    login(owner)
+    response = client.post('/save_puzzle', data=puzzle_form(categories=[str(art)], image=(png(), 'starry.png')),
+                           content_type='multipart/form-data')
+    assert response.status_code == 302
+    with app.app_context():
+        puzzle = db.session.scalar(sa.select(Puzzle).where(Puzzle.title == 'Starry night'))
+        assert [category.name for category in puzzle.categories] == ['Art']
+    # the home page only lists other people's puzzles
+    login(make_user('neighbour'))
+    assert 'Starry night' in client.get('/index?query=art').get_data(as_text=True)
+
+
+def test_edited_puzzle_is_saved_with_its_new_categories(app, client, login, make_user, make_puzzle):
+    owner = make_user('owner')
+    puzzle = make_puzzle(owner, title='Starry night', categories=['Art'])
+    make_puzzle(owner, title='Mountain lake', categories=['Landscape'])
+    art, landscape = category_ids(app, 'Art', 'Landscape')
+    login(owner)
+    form = client.get(f'/save_puzzle/{puzzle.id}').get_data(as_text=True)
+    assert f'<option value="{art}" selected>' in form
+    response = client.post(f'/save_puzzle/{puzzle.id}', data=puzzle_form(
+        puzzle_id=puzzle.id, existing_image_url=puzzle.image_url, categories=[str(art), str(landscape)]))
+    assert response.status_code == 302
+    with app.app_context():
+        assert sorted(category.name for category in db.session.get(Puzzle, puzzle.id).categories) == ['Art', 'Landscape']
+    login(make_user('neighbour'))
+    assert 'Starry night' in client.get('/index?query=landscape').get_data(as_text=True)
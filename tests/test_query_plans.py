@@ -0,0 +1,46 @@
+from app.bench import seed
+from app.query_plans import check_query_plans, plan_problems
+
+
+# every query behind the busiest pages has to use an index on the tables that grow (same check as `flask indexes check`)
+def test_hot_pages_do_not_scan_large_tables(make_app):
+    # short thread pages so the seeded threads have older messages to fetch
+    app = make_app(THREAD_PAGE_SIZE=2)
+    with app.app_context():
+        seed('1k')
+        pages, problems = check_query_plans()
+    assert {'index', 'index_next_page', 'index_search', 'messages', 'messages_thread', 'messages_older', 'user'} <= set(pages)
+    assert problems == {}
+
+
+def plan(*lines):
+    # EXPLAIN QUERY PLAN rows (id, parent, notused, detail) - each line is (id, parent, detail)
+    return [(id, parent, 0, detail) for id, parent, detail in lines]
+
+
+def test_index_walks_are_only_fine_from_the_top_of_the_feed():
+    walk = plan((2, 0, 'SCAN puzzle USING INDEX ix_puzzle_feed'))
+    statement = 'SELECT puzzle.id FROM puzzle ORDER BY puzzle.timestamp DESC LIMIT ?'
+    assert plan_problems('index', statement, walk) == []
+    assert plan_problems('index_next_page', statement, walk) == ['SCAN puzzle USING INDEX ix_puzzle_feed']
+    assert plan_problems('index_next_page', statement, plan((2, 0, 'SEARCH puzzle USING INDEX ix_puzzle_feed (timestamp<?)'))) == []
+
+
+def test_sorting_a_range_of_a_large_table_for_a_limit():
+    statement = 'SELECT message.id FROM message WHERE message.puzzle_id = ? ORDER BY message.timestamp DESC LIMIT ?'
+    sorted_range = plan((3, 0, 'SEARCH message USING INDEX ix_message_puzzle_id (puzzle_id=?)'),
+                        (20, 0, 'USE TEMP B-TREE FOR ORDER BY'))
+    assert plan_problems('messages_thread', statement, sorted_range) == ['USE TEMP B-TREE FOR ORDER BY']
+    # every row comes back anyway
+    assert plan_problems('messages_thread', statement.replace(' LIMIT ?', ''), sorted_range) == []
+    # the rows sorted are looked up one by one from a short list the subquery worked out
+    merged = plan((3, 0, 'SEARCH message USING INTEGER PRIMARY KEY (rowid=?)'),
+                  (5, 0, 'LIST SUBQUERY 4'),
+                  (9, 5, 'SEARCH message USING INDEX ix_message_thread (sender_requester_id=? AND recipient_owner_id=? AND puzzle_id=?)'),
+                  (20, 0, 'USE TEMP B-TREE FOR ORDER BY'))
+    assert plan_problems('messages_thread', statement, merged) == []
+    either_side = plan((2, 0, 'MULTI-INDEX OR'),
+                       (3, 2, 'INDEX 1'),
+                       (6, 3, 'SEARCH conversation USING INDEX ix_conversation_user_a_activity (user_a_id=?)'),
+                       (20, 0, 'USE TEMP B-TREE FOR ORDER BY'))
+    assert plan_problems('messages', 'SELECT * FROM conversation ORDER BY last_activity LIMIT ?', either_side) == ['USE TEMP B-TREE FOR ORDER BY']
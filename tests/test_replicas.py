@@ -0,0 +1,49 @@
+import sqlalchemy as sa
+from app import db
+from app.models import User, Puzzle
+from app.replicas import sync_sqlite_replicas
+
+
+def test_app_without_replicas_still_works_after_one_with_them(make_app, tmp_path):
+    make_app(SQLALCHEMY_REPLICA_URIS=[f'sqlite:///{tmp_path / "replica.db"}'])
+    # make_app runs db.create_all()
+    app = make_app()
+    with app.app_context():
+        assert db.session.scalar(sa.select(sa.func.count(User.id))) == 0
+
+
+def test_reads_go_to_a_replica_until_the_user_writes(make_app, tmp_path):
+    app = make_app(SQLALCHEMY_REPLICA_URIS=[f'sqlite:///{tmp_path / "replica.db"}'])
+    with app.app_context():
+        owner = User(username='owner', email='owner@example.com')
+        requester = User(username='requester', email='requester@example.com')
+        db.session.add_all([owner, requester])
+        db.session.flush()
+        puzzle = Puzzle(user_id=owner.id, title='Mountain lake', pieces=1000, manufacturer='Ravensburger',
+                        image_url='/uploads/puzzle.png', is_available=True, is_requested=False, in_progress=False,
+                        is_deleted=False)
+        db.session.add(puzzle)
+        db.session.commit()
+        owner_id, requester_id, puzzle_id = owner.id, requester.id, puzzle.id
+        sync_sqlite_replicas(db.engine, app.config['SQLALCHEMY_REPLICA_URIS'])
+    replica, = app.extensions['replica_engines']
+    replica_statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        replica_statements.append(statement)
+
+    sa.event.listen(replica, 'before_cursor_execute', capture)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(requester_id)
+
+    assert client.get('/index').status_code == 200
+    assert replica_statements
+
+    response = client.post('/send_message', data={'recipient_id': owner_id, 'puzzle_id': puzzle_id, 'content': 'Hi!'})
+    assert response.status_code == 302
+    replica_statements.clear()
+    # the replica doesn't have the message yet, so the user's next pages read from the primary
+    response = client.get(f'/messages?recipient_id={owner_id}&puzzle_id={puzzle_id}')
+    assert 'Hi!' in response.get_data(as_text=True)
+    assert not replica_statements
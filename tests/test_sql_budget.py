@@ -0,0 +1,62 @@
+import pytest
+import sqlalchemy as sa
+from app import db
+from app.models import User
+from app.sql_budget import query_budget, QueryBudgetExceeded
+
+
+def add_view(app, rule, view):
+    app.add_url_rule(rule, view.__name__, view)
+
+
+def test_view_over_its_budget_fails(app, client):
+    @query_budget(1)
+    def two_queries():
+        db.session.scalar(sa.select(sa.func.count(User.id)))
+        db.session.scalar(sa.select(sa.func.max(User.id)))
+        return 'ok'
+
+    add_view(app, '/two-queries', two_queries)
+    with pytest.raises(QueryBudgetExceeded, match='2 SQL statements, budget is 1'):
+        client.get('/two-queries')
+
+
+def test_repeated_statement_is_reported_as_n_plus_1(app, client, make_user):
+    users = [make_user(f'user{number}') for number in range(5)]
+    user_ids = [user.id for user in users]
+
+    def one_query_per_user():
+        for user_id in user_ids:
+            db.session.scalar(sa.select(User.username).where(User.id == user_id))
+        return 'ok'
+
+    add_view(app, '/one-query-per-user', one_query_per_user)
+    with pytest.raises(QueryBudgetExceeded, match='possible N\\+1: ran 5 times'):
+        client.get('/one-query-per-user')
+
+
+def test_view_within_its_budget_passes(app, client):
+    @query_budget(2)
+    def two_queries():
+        db.session.scalar(sa.select(sa.func.count(User.id)))
+        db.session.scalar(sa.select(sa.func.max(User.id)))
+        return 'ok'
+
+    add_view(app, '/two-queries', two_queries)
+    assert client.get('/two-queries').data == b'ok'
+
+
+# the messaging flow has to stay inside the checks the tests run with
+def test_sending_messages_stays_within_the_sql_checks(app, client, login, make_user, make_puzzle):
+    owner = make_user('owner')
+    requester = make_user('requester')
+    puzzle = make_puzzle(owner)
+    login(requester)
+    for content in ('Is this still available?', 'I can pick it up tomorrow', 'Thanks!'):
+        response = client.post('/send_message', data={'recipient_id': owner.id, 'puzzle_id': puzzle.id, 'content': content})
+        assert response.status_code == 302
+    with app.app_context():
+        assert db.session.get(User, owner.id).unread_count == 3
+    login(owner)
+    response = client.get(f'/messages?recipient_id={requester.id}&puzzle_id={puzzle.id}')
+    assert 'I can pick it up tomorrow' in response.get_data(as_text=True)
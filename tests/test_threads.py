@@ -0,0 +1,49 @@
+import re
+from datetime import datetime, timedelta, timezone
+import pytest
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(THREAD_PAGE_SIZE=3)
+
+
+def message_ids(html):
+    return [int(id) for id in re.findall(r'data-message-id="(\d+)"', html)]
+
+
+# the messages page shows the newest messages and /messages/older hands back the rest a page at a time - every
+# message once, in order, with pages ending in the middle of messages sent at the same moment
+def test_scrolling_up_a_thread(client, login, make_user, make_puzzle, make_message):
+    owner, buyer = make_user('owner'), make_user('buyer')
+    puzzle, other_puzzle = make_puzzle(owner), make_puzzle(owner, title='Night sky')
+    start = datetime.now(timezone.utc)
+    thread = []
+    for number in range(8):
+        sender, recipient = (buyer, owner) if number % 2 == 0 else (owner, buyer)
+        thread.append(make_message(sender, recipient, puzzle, content=f'Message {number}',
+                                   timestamp=start + timedelta(minutes=number // 2)).id)
+    make_message(buyer, owner, other_puzzle)
+    login(owner)
+
+    html = client.get(f'/messages?recipient_id={buyer.id}&puzzle_id={puzzle.id}').get_data(as_text=True)
+    shown = message_ids(html)
+    cursor = re.search(r'data-cursor="([^"]+)"', html).group(1)
+    while cursor:
+        response = client.get('/messages/older', query_string={'recipient_id': buyer.id, 'puzzle_id': puzzle.id,
+                                                                'before': cursor})
+        assert response.status_code == 200
+        older = response.get_json()
+        assert len(message_ids(older['html'])) <= 3
+        shown = message_ids(older['html']) + shown
+        cursor = older['older_cursor']
+    assert shown == thread
+
+
+def test_older_messages_needs_a_cursor(client, login, make_user, make_puzzle):
+    owner, buyer = make_user('owner'), make_user('buyer')
+    puzzle = make_puzzle(owner)
+    login(owner)
+    response = client.get('/messages/older', query_string={'recipient_id': buyer.id, 'puzzle_id': puzzle.id,
+                                                            'before': 'not a cursor'})
+    assert response.status_code == 400
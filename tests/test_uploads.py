@@ -0,0 +1,54 @@
+import hashlib
+import io
+import pytest
+from werkzeug.datastructures import FileStorage
+from config import Config
+from app.uploads import save_upload
+
+IMAGE = b'\x89PNG\r\n\x1a\n' + bytes(range(256))
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    folder = tmp_path / 'uploads'
+    monkeypatch.setattr(Config, 'UPLOADED_PHOTOS_DEST', str(folder))
+    return folder
+
+
+def upload(data, filename='puzzle.png'):
+    return save_upload(FileStorage(io.BytesIO(data), filename=filename))
+
+
+def test_same_bytes_are_stored_once_under_their_hash(app, uploads):
+    with app.app_context():
+        filename = upload(IMAGE)
+        assert filename == hashlib.sha256(IMAGE).hexdigest() + '.png'
+        assert upload(IMAGE, filename='another name.png') == filename
+    assert [path.name for path in uploads.iterdir()] == [filename]
+
+
+def test_content_addressed_upload_is_cached_for_good(app, uploads, client):
+    with app.app_context():
+        filename = upload(IMAGE)
+    response = client.get(f'/uploads/{filename}')
+    assert response.status_code == 200
+    assert response.data == IMAGE
+    assert response.get_etag() == (hashlib.sha256(IMAGE).hexdigest(), False)
+    assert response.cache_control.immutable and response.cache_control.public
+    assert response.cache_control.max_age == 31536000
+
+    revalidated = client.get(f'/uploads/{filename}', headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+    partial = client.get(f'/uploads/{filename}', headers={'Range': 'bytes=0-7'})
+    assert partial.status_code == 206
+    assert partial.data == IMAGE[:8]
+    assert partial.headers['Content-Range'] == f'bytes 0-7/{len(IMAGE)}'
+
+
+def test_legacy_upload_is_only_cached_for_a_while(uploads, client):
+    uploads.mkdir()
+    (uploads / 'my_puzzle.png').write_bytes(IMAGE)
+    response = client.get('/uploads/my_puzzle.png')
+    assert response.status_code == 200
+    assert response.cache_control.max_age == 3600
+    assert not response.cache_control.immutable